@@ -0,0 +1,43 @@
+import subprocess
+import sys
+
+handlers = {
+    "generate_page_summary": ["lib.summary"],
+    "twitter_import": ["lib.encryption", "lib.twitter"],
+    "twitter_process_links": ["lib.encryption", "lib.links"],
+    "twitter_clean_links": ["lib.encryption", "lib.twitter", "lib.links"],
+    "twitter_hydrate_links": ["lib.encryption", "lib.twitter", "lib.links"],
+    "twitter_unshorten_links": ["lib.encryption", "lib.twitter", "lib.links"],
+    "github_import": ["lib.encryption", "lib.github"],
+    "meetup_events_import": ["lib.encryption", "lib.meetup"],
+    "meetup_groups_import": ["lib.encryption", "lib.meetup"],
+    "so_import": ["lib.encryption", "lib.so"],
+    "so_backfill": ["lib.encryption", "lib.so"],
+    "so_refresh": ["lib.encryption", "lib.so"],
+    "twitter_backfill": ["lib.encryption", "lib.twitter"],
+}
+
+measure = """\
+import time
+start = time.perf_counter()
+import handler
+{imports}
+print(time.perf_counter() - start)
+"""
+
+
+def import_time(modules):
+    imports = "\n".join("import {0}".format(module) for module in modules)
+    output = subprocess.check_output([sys.executable, "-c", measure.format(imports=imports)])
+    return float(output.decode("utf-8").strip())
+
+
+def main(rounds=5):
+    for handler, modules in handlers.items():
+        timings = sorted(import_time(modules) for _ in range(rounds))
+        print("{handler:<25} median {median:8.1f} ms  min {min:8.1f} ms".format(
+            handler=handler, median=timings[len(timings) // 2] * 1000, min=timings[0] * 1000))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
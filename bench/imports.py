@@ -0,0 +1,143 @@
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Runs each importer against recorded API responses and a local Neo4j, one subprocess per importer so peak
+# memory and module state are measured in isolation. Record fixtures once with live credentials:
+#
+#   HTTP_FIXTURES=record:bench/fixtures TWITTER_BEARER=... python -m bench.imports bolt://localhost neo4j pass
+#
+# then replay them offline, optionally with synthetic latency and generous rate-limit headers:
+#
+#   HTTP_FIXTURES=replay:bench/fixtures HTTP_FIXTURES_LATENCY=0.05 HTTP_FIXTURES_REMAINING=5000 \
+#       python -m bench.imports bolt://localhost neo4j pass twitter github
+#
+# Use a throwaway database: the importers write to it, and a second run mostly measures skipped writes.
+
+importers = {
+    "twitter": "twitter.import_links(url, user, password, bearer_token=env('TWITTER_BEARER'), search=env('TWITTER_SEARCH', 'neo4j'))",
+    "links": "links.process_links(url, user, password)",
+    "github": "github.import_github(url, user, password, tag=env('TAG', 'neo4j'), github_token=env('GITHUB_TOKEN'))",
+    "meetup_groups": "meetup.import_groups(url, user, password, tag=env('TAG', 'neo4j'), meetup_key=env('MEETUP_API_KEY'))",
+    "meetup_events": "meetup.import_events(url, user, password, meetup_key=env('MEETUP_API_KEY'))",
+    "stackoverflow": "so.import_so(url, user, password, tag=env('TAG', 'neo4j'))",
+}
+
+run_importer = """\
+import sys
+from bench.imports import measure
+measure({importer!r}, *sys.argv[1:4])
+"""
+
+write_statement = re.compile(r"\b(MERGE|CREATE|SET|DELETE|REMOVE)\b", re.IGNORECASE)
+
+
+def env(name, default="replay"):
+    return os.environ.get(name, default)
+
+
+def count_records(content):
+    try:
+        body = json.loads(content.decode("utf-8"))
+    except ValueError:
+        return 1
+    if isinstance(body, list):
+        return len(body)
+    if not isinstance(body, dict):
+        return 1
+    for key in ["statuses", "items", "results"]:
+        if isinstance(body.get(key), list):
+            return len(body[key])
+    search = (body.get("data") or {}).get("search") or {}
+    return len(search.get("nodes") or [])
+
+
+def measure(importer, url, user, password):
+    import lib.fixtures as fixtures
+    import lib.github as github
+    import lib.links as links
+    import lib.meetup as meetup
+    import lib.so as so
+    import lib.twitter as twitter
+    from neo4j.v1.api import Session
+
+    totals = {"pages": 0, "records": 0, "db_write_seconds": 0.0}
+
+    def observe(_, status, content):
+        totals["pages"] += 1
+        if status // 100 == 2:
+            totals["records"] += count_records(content)
+
+    if fixtures.store is not None:
+        fixtures.store.observers.append(observe)
+
+    write_transaction = Session.write_transaction
+    run = Session.run
+    # Transaction.run goes through Session.run, so statements inside a timed transaction are not timed again.
+    local = threading.local()
+
+    def timed_write_transaction(self, *args, **kwargs):
+        start = time.perf_counter()
+        local.in_transaction = True
+        try:
+            return write_transaction(self, *args, **kwargs)
+        finally:
+            local.in_transaction = False
+            totals["db_write_seconds"] += time.perf_counter() - start
+
+    def timed_run(self, statement, *args, **kwargs):
+        if getattr(local, "in_transaction", False) or not write_statement.search(statement):
+            return run(self, statement, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            result = run(self, statement, *args, **kwargs)
+            result.detach()
+            return result
+        finally:
+            totals["db_write_seconds"] += time.perf_counter() - start
+
+    Session.write_transaction = timed_write_transaction
+    Session.run = timed_run
+
+    namespace = {"twitter": twitter, "links": links, "github": github, "meetup": meetup, "so": so, "env": env,
+                 "url": url, "user": user, "password": password}
+    start = time.perf_counter()
+    eval(importers[importer], namespace)
+    totals["seconds"] = time.perf_counter() - start
+    totals["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print(json.dumps(totals))
+
+
+def run(importer, neo4j_url, neo4j_user, neo4j_pass, state_prefix):
+    environment = dict(os.environ, CHECKPOINT_STORE="sqlite:" + state_prefix + ".db",
+                       REDIRECT_CACHE="sqlite:" + state_prefix + "-redirects.db",
+                       HOST_HEALTH="sqlite:" + state_prefix + "-hosts.db")
+    output = subprocess.check_output([sys.executable, "-c", run_importer.format(importer=importer),
+                                      neo4j_url, neo4j_user, neo4j_pass], env=environment)
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def main(neo4j_url="bolt://localhost", neo4j_user="neo4j", neo4j_pass="neo4j", *selected):
+    if not os.environ.get("HTTP_FIXTURES"):
+        raise Exception("Set HTTP_FIXTURES to record:<dir> or replay:<dir>")
+
+    # Every importer starts from empty watermarks so replayed requests line up with the recorded ones.
+    with tempfile.TemporaryDirectory() as directory:
+        for importer in selected or importers:
+            totals = run(importer, neo4j_url, neo4j_user, neo4j_pass, os.path.join(directory, importer))
+            seconds = max(totals["seconds"], 1e-9)
+            print("{importer:<15} {pages:6d} pages {pages_rate:8.1f} pages/s {records:7d} records "
+                  "{records_rate:9.1f} records/s  db write {db:7.2f} s  peak rss {rss:7.1f} MB".format(
+                      importer=importer, pages=totals["pages"], pages_rate=totals["pages"] / seconds,
+                      records=totals["records"], records_rate=totals["records"] / seconds,
+                      db=totals["db_write_seconds"], rss=totals["peak_rss_mb"]))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
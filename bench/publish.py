@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+
+from lib.publish import publish, s3_bucket
+from lib.summary import render, summary_queries
+
+# Publishes the same summary data twice against an S3 stand-in and fails if the second run uploads again:
+#
+#   S3_ENDPOINT=http://localhost:5000 python -m bench.publish summary-bench
+#
+# The bucket must already exist. Item times are a few hours old, so any relative time in the rendered page would
+# change between runs that are a minute apart; pass a delay in seconds to check that too.
+
+
+def sample_sections(now_ms):
+    sections = {name: [] for name, _ in summary_queries}
+    sections["twitter_records"] = [{"title": "Graph of the week", "url": "https://neo4j.com/blog/graph-of-the-week",
+                                    "score": 12, "users": ["neo4j"], "dateCreated": now_ms - 5 * 60 * 60 * 1000}]
+    sections["github_records"] = [{"n.url": "https://github.com/neo4j/example", "n.title": "example",
+                                   "n.description": "An example", "user.name": "neo4j", "n.favorites": 3,
+                                   "n.pushed": now_ms - 2 * 60 * 60 * 1000, "n.created": now_ms - 3 * 60 * 60 * 1000}]
+    sections["meetup_records"] = [{"event": {"link": "https://meetup.com/graphs/1", "title": "Graph night",
+                                             "time": now_ms + 26 * 60 * 60 * 1000},
+                                   "group": {"title": "Graph Database London"}}]
+    return sections
+
+
+def main(bucket_name, delay=0):
+    if not os.environ.get("S3_ENDPOINT"):
+        raise Exception("Set S3_ENDPOINT to an S3 stand-in")
+
+    bucket = s3_bucket(bucket_name)
+    sections = sample_sections(int(time.time() * 1000))
+    results = []
+    for run in range(2):
+        if run > 0:
+            time.sleep(delay)
+        body, digest = render(sections, [], "Neo4j", "logo.png")
+        results.append(publish(bucket, "summary-bench.html", body, digest))
+        print("run", run + 1, results[-1])
+
+    if results[1]["uploaded"]:
+        raise SystemExit("Unchanged data was uploaded again")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2], *[float(arg) for arg in sys.argv[2:3]])
@@ -0,0 +1,47 @@
+import sys
+import time
+import uuid
+
+from lib.resources import graph_driver
+from lib.schema import apply_schema, index
+
+merge_query = """\
+UNWIND {rows} AS row
+MERGE (link:{label} {{url:row.url}})
+SET link.seen = row.seen
+"""
+
+
+def merge_throughput(session, label, nodes, batch_size):
+    rows = [{"url": "https://example.com/{0}".format(i), "seen": i} for i in range(nodes)]
+    query = merge_query.format(label=label)
+
+    # Create the nodes once, then time the MERGEs that hit existing nodes.
+    for start in range(0, nodes, batch_size):
+        session.run(query, {"rows": rows[start:start + batch_size]}).consume()
+
+    start_time = time.perf_counter()
+    for start in range(0, nodes, batch_size):
+        session.run(query, {"rows": rows[start:start + batch_size]}).consume()
+    return nodes / (time.perf_counter() - start_time)
+
+
+def main(neo4j_url, neo4j_user, neo4j_pass, nodes=20000, batch_size=1000):
+    with graph_driver(neo4j_url, neo4j_user, neo4j_pass) as driver:
+        with driver.session() as session:
+            for with_schema in [False, True]:
+                label = "BenchLink{0}".format(uuid.uuid4().hex[:8])
+                if with_schema:
+                    apply_schema(session, [(index, label, "url")])
+                    session.run("CALL db.awaitIndexes()").consume()
+
+                rate = merge_throughput(session, label, nodes, batch_size)
+                print("schema" if with_schema else "no schema", "{0:10.0f} merges/s".format(rate))
+
+                session.run("MATCH (link:{label}) DETACH DELETE link".format(label=label)).consume()
+                if with_schema:
+                    session.run("DROP INDEX ON :{label}(url)".format(label=label)).consume()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:4], *[int(arg) for arg in sys.argv[4:6]])
@@ -0,0 +1,52 @@
+import glob
+import os
+import sys
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from lib.titles import extract_head
+
+chunk_size = 8192
+
+
+def soup_title(body):
+    titles = BeautifulSoup(body.decode("utf-8", "replace"), "html.parser").find_all("title")
+    return titles[0].text if len(titles) > 0 else None
+
+
+def streamed_title(body):
+    chunks = (body[i:i + chunk_size] for i in range(0, len(body), chunk_size))
+    return extract_head(chunks)["title"]
+
+
+def measure(name, fn, pages, rounds):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for body in pages:
+            fn(body)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_page = elapsed / (rounds * len(pages)) * 1000
+    print("{name:<10} {per_page:8.3f} ms/page  peak {peak:8.1f} KiB".format(name=name, per_page=per_page,
+                                                                          peak=peak / 1024))
+
+
+def main(corpus, rounds=5):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(corpus, "*"))):
+        with open(path, "rb") as file:
+            pages.append(file.read())
+    if len(pages) == 0:
+        raise Exception("No saved pages found in {0}".format(corpus))
+
+    print("pages", len(pages), "bytes", sum(len(body) for body in pages), "rounds", rounds)
+    measure("soup", soup_title, pages, rounds)
+    measure("streamed", streamed_title, pages, rounds)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], *[int(arg) for arg in sys.argv[2:3]])
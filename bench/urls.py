@@ -0,0 +1,65 @@
+import random
+import sys
+import time
+from urllib.parse import urlencode, urlparse, urlunparse, parse_qs
+
+from lib.urls import canonical_url
+
+hosts = ["neo4j.com", "Neo4j.com", "www.youtube.com", "github.com", "medium.com", "dzone.com", "t.co"]
+params = ["utm_source=twitter", "utm_medium=social", "fbclid=IwAR0abc", "ref_src=twsrc", "id=42", "page=2",
+          "lang=en", "v=dQw4w9WgXcQ"]
+
+
+def clean_uri(url):
+    # The cleaner canonical_url replaced, kept here for comparison.
+    u = urlparse(url)
+    query = parse_qs(u.query.decode("utf-8"))
+
+    for param in ["utm_content", "utm_source", "utm_medium", "utm_campaign", "utm_term"]:
+        query.pop(param, None)
+
+    u = u._replace(query=bytes(urlencode(query, True), "utf-8"))
+
+    return urlunparse(u).decode("utf-8")
+
+
+def synthetic_corpus(size, seed=42):
+    rng = random.Random(seed)
+    urls = []
+    for _ in range(size):
+        path = "/{0}/{1}".format(rng.choice(["blog", "watch", "graphs", "post"]), rng.randint(0, size // 500))
+        if rng.random() < 0.3:
+            path += "/"
+        query = "&".join(rng.sample(params, rng.randint(0, 3)))
+        url = "{0}://{1}{2}".format(rng.choice(["https", "https", "http"]), rng.choice(hosts), path)
+        if query:
+            url += "?" + query
+        if rng.random() < 0.2:
+            url += "#comments"
+        urls.append(url)
+    return urls
+
+
+def measure(name, fn, urls, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        distinct = {fn(url) for url in urls}
+    elapsed = time.perf_counter() - start
+    print("{name:<10} {rate:12.0f} urls/s  {distinct:8d} distinct of {total}".format(
+        name=name, rate=rounds * len(urls) / elapsed, distinct=len(distinct), total=len(urls)))
+
+
+def main(corpus=None, rounds=5):
+    if corpus:
+        with open(corpus) as file:
+            urls = [line.strip() for line in file if line.strip()]
+    else:
+        urls = synthetic_corpus(200000)
+
+    print("urls", len(urls), "raw distinct", len(set(urls)), "rounds", rounds)
+    measure("clean_uri", lambda url: clean_uri(url.encode("utf-8")), urls, rounds)
+    measure("canonical", canonical_url, urls, rounds)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2], *[int(arg) for arg in sys.argv[2:3]])
@@ -1,18 +1,27 @@
+import functools
 import os
 
-import lib.meetup as meetup
-import lib.so as so
-import lib.summary as summary
-import lib.twitter as twitter
-import lib.github as github
 
-from lib.encryption import decrypt_value
+def instrumented(handler):
+    @functools.wraps(handler)
+    def run(event, context):
+        import lib.metrics as metrics
+        with metrics.invocation(handler.__name__):
+            return handler(event, context)
+
+    return run
 
 
 def str_to_bool(s):
     return s == 'True'
 
 
+def decrypt_value(encrypted):
+    from lib.encryption import decrypt_value
+    return decrypt_value(encrypted)
+
+
+@instrumented
 def generate_page_summary(event, _):
     if str_to_bool(os.environ.get("GENERATE_SUMMARY_PAGE", "False")):
         print("Event:", event)
@@ -22,12 +31,18 @@ def generate_page_summary(event, _):
         title = os.environ["TITLE"]
         short_name = os.environ["SUMMARY"]
         logo_src = os.environ["LOGO"]
+        concurrency = int(os.environ.get("SUMMARY_CONCURRENCY", "4"))
+        query_timeout = int(os.environ.get("SUMMARY_QUERY_TIMEOUT", "60"))
 
-        summary.generate(url, user, password, title, short_name, logo_src)
+        import lib.summary as summary
 
+        summary.generate(url, user, password, title, short_name, logo_src, concurrency, query_timeout)
 
+
+@instrumented
 def twitter_import(event, _):
     print("Event:", event)
+    import lib.twitter as twitter
 
     neo4j_url = os.environ.get('NEO4J_URL', "bolt://localhost")
     neo4j_user = os.environ.get('NEO4J_USER', "neo4j")
@@ -43,8 +58,22 @@ def twitter_import(event, _):
 
 
 
+@instrumented
+def twitter_process_links(event, _):
+    print("Event:", event)
+    import lib.links as links
+
+    neo4j_url = os.environ.get('NEO4J_URL', "bolt://localhost")
+    neo4j_user = os.environ.get('NEO4J_USER', "neo4j")
+    neo4j_password = decrypt_value(os.environ['NEO4J_PASSWORD'])
+
+    links.process_links(neo4j_url=neo4j_url, neo4j_user=neo4j_user, neo4j_pass=neo4j_password)
+
+
+@instrumented
 def twitter_clean_links(event, _):
     print("Event:", event)
+    import lib.twitter as twitter
 
     neo4j_url = os.environ.get('NEO4J_URL', "bolt://localhost")
     neo4j_user = os.environ.get('NEO4J_USER', "neo4j")
@@ -53,8 +82,10 @@ def twitter_clean_links(event, _):
     twitter.clean_links(neo4j_url=neo4j_url, neo4j_user=neo4j_user, neo4j_pass=neo4j_password)
 
 
+@instrumented
 def twitter_hydrate_links(event, _):
     print("Event:", event)
+    import lib.twitter as twitter
 
     neo4j_url = os.environ.get('NEO4J_URL', "bolt://localhost")
     neo4j_user = os.environ.get('NEO4J_USER', "neo4j")
@@ -63,8 +94,10 @@ def twitter_hydrate_links(event, _):
     twitter.hydrate_links(neo4j_url=neo4j_url, neo4j_user=neo4j_user, neo4j_pass=neo4j_password)
 
 
+@instrumented
 def twitter_unshorten_links(event, _):
     print("Event:", event)
+    import lib.twitter as twitter
 
     neo4j_url = os.environ.get('NEO4J_URL', "bolt://localhost")
     neo4j_user = os.environ.get('NEO4J_USER', "neo4j")
@@ -73,8 +106,10 @@ def twitter_unshorten_links(event, _):
     twitter.unshorten_links(neo4j_url=neo4j_url, neo4j_user=neo4j_user, neo4j_pass=neo4j_password)
 
 
+@instrumented
 def github_import(event, _):
     print("Event:", event)
+    import lib.github as github
 
     neo4j_url = os.environ.get('NEO4J_URL', "bolt://localhost")
     neo4j_user = os.environ.get('NEO4J_USER', "neo4j")
@@ -87,8 +122,10 @@ def github_import(event, _):
                          github_token=github_token)
 
 
+@instrumented
 def meetup_events_import(event, _):
     print("Event:", event)
+    import lib.meetup as meetup
 
     neo4j_url = os.environ.get('NEO4J_URL', "bolt://localhost")
     neo4j_user = os.environ.get('NEO4J_USER', "neo4j")
@@ -98,8 +135,10 @@ def meetup_events_import(event, _):
     meetup.import_events(neo4j_url=neo4j_url, neo4j_user=neo4j_user, neo4j_pass=neo4j_password, meetup_key=meetup_key)
 
 
+@instrumented
 def meetup_groups_import(event, _):
     print("Event:", event)
+    import lib.meetup as meetup
 
     neo4j_url = os.environ.get('NEO4J_URL', "bolt://localhost")
     neo4j_user = os.environ.get('NEO4J_USER', "neo4j")
@@ -112,8 +151,10 @@ def meetup_groups_import(event, _):
                          meetup_key=meetup_key)
 
 
+@instrumented
 def so_import(event, _):
     print("Event:", event)
+    import lib.so as so
 
     neo4j_url = os.environ.get('NEO4J_URL', "bolt://localhost")
     neo4j_user = os.environ.get('NEO4J_USER', "neo4j")
@@ -122,3 +163,45 @@ def so_import(event, _):
     tag = os.environ.get('TAG')
 
     so.import_so(neo4j_url=neo4j_url, neo4j_user=neo4j_user, neo4j_pass=neo4j_password, tag=tag)
+
+
+@instrumented
+def so_backfill(event, _):
+    print("Event:", event)
+    import lib.so as so
+
+    neo4j_url = os.environ.get('NEO4J_URL', "bolt://localhost")
+    neo4j_user = os.environ.get('NEO4J_USER', "neo4j")
+    neo4j_password = decrypt_value(os.environ['NEO4J_PASSWORD'])
+
+    tag = os.environ.get('TAG')
+
+    so.import_so(neo4j_url=neo4j_url, neo4j_user=neo4j_user, neo4j_pass=neo4j_password, tag=tag, backfill=True)
+
+
+@instrumented
+def so_refresh(event, _):
+    print("Event:", event)
+    import lib.so as so
+
+    neo4j_url = os.environ.get('NEO4J_URL', "bolt://localhost")
+    neo4j_user = os.environ.get('NEO4J_USER', "neo4j")
+    neo4j_password = decrypt_value(os.environ['NEO4J_PASSWORD'])
+
+    so.refresh_so(neo4j_url=neo4j_url, neo4j_user=neo4j_user, neo4j_pass=neo4j_password)
+
+
+@instrumented
+def twitter_backfill(event, _):
+    print("Event:", event)
+    import lib.twitter as twitter
+
+    neo4j_url = os.environ.get('NEO4J_URL', "bolt://localhost")
+    neo4j_user = os.environ.get('NEO4J_USER', "neo4j")
+    neo4j_password = decrypt_value(os.environ['NEO4J_PASSWORD'])
+    twitter_bearer = decrypt_value(os.environ['TWITTER_BEARER'])
+
+    search = os.environ.get("TWITTER_SEARCH")
+
+    twitter.import_links(neo4j_url=neo4j_url, neo4j_user=neo4j_user, neo4j_pass=neo4j_password,
+                         bearer_token=twitter_bearer, search=search, backfill=True)
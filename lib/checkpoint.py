@@ -0,0 +1,80 @@
+import json
+import os
+import sqlite3
+import time
+
+load_checkpoint_query = """\
+MATCH (state:ImportState {name:{name}})
+RETURN state.value AS value
+"""
+
+save_checkpoint_query = """\
+MERGE (state:ImportState {name:{name}})
+SET state.value = {value}, state.updated = timestamp()
+"""
+
+
+class GraphCheckpoints:
+    transactional = True
+
+    def load(self, runner, name, default=None):
+        for record in runner.run(load_checkpoint_query, {"name": name}):
+            if record["value"] is not None:
+                return record["value"]
+        return default
+
+    def save(self, runner, name, value):
+        runner.run(save_checkpoint_query, {"name": name, "value": value}).consume()
+
+
+class SqliteCheckpoints:
+    transactional = False
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints (name TEXT PRIMARY KEY, value TEXT, updated REAL)")
+
+    def load(self, runner, name, default=None):
+        row = self.connection.execute("SELECT value FROM checkpoints WHERE name = ?", (name,)).fetchone()
+        value = None if row is None else json.loads(row[0])
+        return default if value is None else value
+
+    def save(self, runner, name, value):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)",
+                                    (name, json.dumps(value), time.time()))
+
+
+def checkpoint_store(location=None):
+    location = location or os.environ.get("CHECKPOINT_STORE", "graph")
+    if location == "graph":
+        return GraphCheckpoints()
+    if location.startswith("sqlite:"):
+        return SqliteCheckpoints(location[len("sqlite:"):])
+    raise Exception("Unknown checkpoint store {0}".format(location))
+
+
+store = checkpoint_store()
+
+
+def load_checkpoint(runner, name, default=None):
+    return store.load(runner, name, default)
+
+
+def save_checkpoint(runner, name, value):
+    store.save(runner, name, value)
+
+
+def write_batch(session, work, name, value, *args):
+    if store.transactional:
+        def unit_of_work(tx):
+            result = work(tx, *args)
+            store.save(tx, name, value)
+            return result
+
+        return session.write_transaction(unit_of_work)
+
+    result = session.write_transaction(work, *args)
+    store.save(session, name, value)
+    return result
@@ -0,0 +1,34 @@
+import hashlib
+import json
+
+import lib.metrics as metrics
+
+stored_digests_query = """\
+UNWIND {{ids}} AS id
+MATCH (n:{label} {{id:id}})
+RETURN n.id AS id, n.digest AS digest
+"""
+
+
+def digest(record):
+    return hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ChangeFilter:
+    def __init__(self, label, key="id"):
+        self.label = label
+        self.key = key
+
+    def changed(self, runner, records):
+        with metrics.stage("digest") as measured:
+            latest = {}
+            for record in records:
+                latest[record[self.key]] = dict(record, digest=digest(record))
+
+            result = runner.run(stored_digests_query.format(label=self.label), {"ids": list(latest)})
+            stored = {record["id"]: record["digest"] for record in result}
+
+            changed = [record for id, record in latest.items() if stored.get(id) != record["digest"]]
+            measured.records = len(records)
+            measured.counters = {"written": len(changed), "skipped": len(records) - len(changed)}
+            return changed
@@ -0,0 +1,239 @@
+import base64
+import collections
+import datetime
+import glob
+import hashlib
+import http.client
+import io
+import json
+import os
+import threading
+import time
+from datetime import timezone
+from urllib.parse import urlparse, urlencode, parse_qsl
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# Credentials passed as query parameters are left out of fixture keys and files.
+secret_params = {"key", "access_token", "client_secret"}
+dropped_headers = {"content-encoding", "content-length", "transfer-encoding", "set-cookie"}
+rate_limit_window = 15 * 60
+
+
+def strip_secrets(url):
+    parsed = urlparse(url)
+    query = [(name, value) for name, value in parse_qsl(parsed.query, keep_blank_values=True)
+             if name not in secret_params]
+    return parsed._replace(query=urlencode(query)).geturl()
+
+
+def endpoint_of(method, url):
+    parsed = urlparse(url)
+    return "{0} {1}://{2}{3}".format(method, parsed.scheme, parsed.netloc.lower(), parsed.path)
+
+
+def fixture_key(method, url, body):
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    digest = hashlib.sha1("{0} {1}".format(method, strip_secrets(url)).encode("utf-8"))
+    digest.update(body or b"")
+    return digest.hexdigest()
+
+
+class FixtureStore:
+    def __init__(self, mode, path, latency=0.0, remaining=None):
+        self.mode = mode
+        self.path = path
+        self.latency = latency
+        self.remaining = remaining
+        self.lock = threading.Lock()
+        self.fixtures = None
+        self.by_key = collections.defaultdict(collections.deque)
+        self.by_endpoint = collections.defaultdict(collections.deque)
+        self.used = set()
+        self.observers = []
+        if mode == "record":
+            os.makedirs(path, exist_ok=True)
+
+    def load(self):
+        with self.lock:
+            if self.fixtures is not None:
+                return
+            fixtures = []
+            for file_name in glob.glob(os.path.join(self.path, "*.json")):
+                with open(file_name) as file:
+                    fixtures.append(json.load(file))
+            fixtures.sort(key=lambda fixture: fixture["recorded"])
+            for index, fixture in enumerate(fixtures):
+                self.by_key[fixture["key"]].append(index)
+                self.by_endpoint[fixture["endpoint"]].append(index)
+            self.fixtures = fixtures
+
+    def record(self, method, url, body, status, headers, content):
+        fixture = {"key": fixture_key(method, url, body), "endpoint": endpoint_of(method, url),
+                   "url": strip_secrets(url), "recorded": time.time(), "status": status,
+                   "headers": {name: value for name, value in headers.items() if name.lower() not in dropped_headers},
+                   "body": base64.b64encode(content).decode("ascii")}
+        file_name = os.path.join(self.path, "{0:.6f}-{1}.json".format(fixture["recorded"], fixture["key"]))
+        with open(file_name, "w") as file:
+            json.dump(fixture, file)
+        self.notify(url, status, content)
+
+    def take(self, candidates):
+        while candidates:
+            index = candidates.popleft()
+            if index not in self.used:
+                self.used.add(index)
+                return self.fixtures[index]
+        return None
+
+    def replay(self, method, url, body):
+        self.load()
+        # Requests that embed watermarks or timestamps rarely match exactly, so fall back to the
+        # next unused recording for the same endpoint, in the order they were recorded.
+        with self.lock:
+            fixture = self.take(self.by_key[fixture_key(method, url, body)]) or \
+                      self.take(self.by_endpoint[endpoint_of(method, url)])
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if fixture is None:
+            return None
+
+        headers, content = self.rate_limited(dict(fixture["headers"]), base64.b64decode(fixture["body"]))
+        self.notify(url, fixture["status"], content)
+        return fixture["status"], headers, content
+
+    def rate_limited(self, headers, content):
+        if self.remaining is None:
+            return headers, content
+
+        now = time.time()
+        for name in headers:
+            lower = name.lower()
+            if lower in ("x-rate-limit-remaining", "x-ratelimit-remaining"):
+                headers[name] = str(self.remaining)
+            elif lower == "x-rate-limit-reset":
+                headers[name] = str(int(now) + rate_limit_window)
+            elif lower == "x-ratelimit-reset":
+                headers[name] = str(rate_limit_window)
+
+        try:
+            body = json.loads(content.decode("utf-8"))
+        except ValueError:
+            return headers, content
+        if not isinstance(body, dict):
+            return headers, content
+        if "quota_remaining" in body:
+            body["quota_remaining"] = self.remaining
+        rate_limit = (body.get("data") or {}).get("rateLimit")
+        if rate_limit is not None:
+            rate_limit["remaining"] = self.remaining
+            rate_limit["resetAt"] = datetime.datetime.fromtimestamp(now + rate_limit_window, timezone.utc).isoformat()
+        return headers, json.dumps(body).encode("utf-8")
+
+    def notify(self, url, status, content):
+        for observer in self.observers:
+            observer(url, status, content)
+
+
+class FixtureAdapter(BaseAdapter):
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        self.live = HTTPAdapter(pool_connections=1, pool_maxsize=10)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.store.mode == "record":
+            response = self.live.send(request, stream=stream, timeout=timeout, verify=verify, cert=cert,
+                                      proxies=proxies)
+            self.store.record(request.method, request.url, request.body, response.status_code, response.headers,
+                              response.content)
+            return response
+
+        replayed = self.store.replay(request.method, request.url, request.body)
+        if replayed is None:
+            raise requests.exceptions.ConnectionError(
+                "No recorded response for {0} {1}".format(request.method, strip_secrets(request.url)), request=request)
+
+        status, headers, content = replayed
+        response = requests.Response()
+        response.status_code = status
+        response.reason = http.client.responses.get(status, "")
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.raw = io.BytesIO(content)
+        return response
+
+    def close(self):
+        self.live.close()
+
+
+class FixtureResponse:
+    def __init__(self, status, headers, content):
+        self.status = status
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.will_close = False
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def read(self):
+        return self.content
+
+
+class FixtureConnection:
+    # Stands in for http.client connections in lib.resolver, which bypasses requests.
+    def __init__(self, store, scheme, netloc, timeout):
+        self.store = store
+        self.scheme = scheme
+        self.netloc = netloc
+        self.timeout = timeout
+        self.sock = None
+        self.response = None
+
+    def request(self, method, path):
+        url = "{0}://{1}{2}".format(self.scheme, self.netloc, path)
+        if self.store.mode == "record":
+            connection_type = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            connection = connection_type(self.netloc, timeout=self.timeout)
+            try:
+                connection.request(method, path)
+                live = connection.getresponse()
+                content = live.read()
+            finally:
+                connection.close()
+            self.store.record(method, url, None, live.status, dict(live.getheaders()), content)
+            self.response = FixtureResponse(live.status, dict(live.getheaders()), content)
+            return
+
+        replayed = self.store.replay(method, url, None)
+        if replayed is None:
+            raise ConnectionError("No recorded response for {0} {1}".format(method, strip_secrets(url)))
+        self.response = FixtureResponse(*replayed)
+
+    def getresponse(self):
+        return self.response
+
+    def close(self):
+        pass
+
+
+def fixture_store():
+    setting = os.environ.get("HTTP_FIXTURES", "")
+    if not setting:
+        return None
+    mode, _, path = setting.partition(":")
+    if mode not in ("record", "replay") or not path:
+        raise Exception("HTTP_FIXTURES should be record:<dir> or replay:<dir>, got {0}".format(setting))
+    remaining = os.environ.get("HTTP_FIXTURES_REMAINING")
+    return FixtureStore(mode, path, latency=float(os.environ.get("HTTP_FIXTURES_LATENCY", "0")),
+                        remaining=int(remaining) if remaining else None)
+
+
+store = fixture_store()
@@ -3,9 +3,15 @@ import json
 import time
 from datetime import timezone
 
-import requests
 from dateutil.parser import parse
-from neo4j.v1 import GraphDatabase, basic_auth
+
+from lib.checkpoint import load_checkpoint, save_checkpoint
+from lib.digest import ChangeFilter
+import lib.metrics as metrics
+from lib.pipeline import run_pipeline, interleave
+from lib.ratelimit import limiter
+from lib.resources import graph_driver, http_session
+from lib.schema import ensure_schema
 
 import_query = """
 WITH {json} as data
@@ -23,7 +29,7 @@ SET repo.favorites = r.stargazers_count,
     repo.size = r.size,
     repo.watchers = r.watchers, repo.language = r.language, repo.forks = r.forks_count,
     repo.open_issues = r.open_issues, repo.branch = r.default_branch, repo.description = r.description,
-    repo.isPrivate = r.isPrivate
+    repo.isPrivate = r.isPrivate, repo.digest = r.digest
 
 MERGE (owner:User:GitHub {id:r.owner.id})
 SET owner.name = r.owner.login, owner.type=r.owner.type, owner.full_name = r.owner.name,
@@ -31,6 +37,30 @@ SET owner.name = r.owner.login, owner.type=r.owner.type, owner.full_name = r.own
 MERGE (owner)-[:CREATED]->(repo)
 """
 
+
+def write_repositories(tx, items, changes):
+    items = changes.changed(tx, items)
+    if len(items) == 0:
+        return {}
+    return tx.run(import_query, {"json": {"items": items}}).consume().counters
+
+
+search_limit = 1000
+
+count_query = """\
+query Count($searchTerm: String!) {
+ rateLimit {
+    limit
+    cost
+    remaining
+    resetAt
+ }
+ search(query:$searchTerm, type: REPOSITORY, first: 1) {
+   repositoryCount
+ }
+}
+"""
+
 graphql_query = """\
 query Repositories($searchTerm: String!, $cursor: String) {
  rateLimit {
@@ -88,85 +118,147 @@ query Repositories($searchTerm: String!, $cursor: String) {
 """
 
 
-def import_github(neo4j_url, neo4j_user, neo4j_pass, tag, github_token):
-    with GraphDatabase.driver(neo4j_url, auth=basic_auth(neo4j_user, neo4j_pass)) as driver:
+def import_github(neo4j_url, neo4j_user, neo4j_pass, tag, github_token, workers=4):
+    with graph_driver(neo4j_url, neo4j_user, neo4j_pass) as driver:
         with driver.session() as session:
-            from_date = (datetime.datetime.now() - datetime.timedelta(days=90)).strftime("%Y-%m-%d")
+            ensure_schema(session, "github")
+            now = datetime.datetime.now(timezone.utc).replace(microsecond=0)
+            watermark = "github:{tag}".format(tag=tag)
+            pushed_at = load_checkpoint(session, watermark, "")
+            from_date = parse(pushed_at) if pushed_at else now - datetime.timedelta(days=90)
 
             print("Processing projects from {0}".format(from_date))
 
-            search = "{0} pushed:>{1}".format(tag, from_date)
-            cursor = None
-            has_more = True
-
-            while has_more:
-                apiUrl = "https://api.github.com/graphql"
-
-                data = {
-                    "query": graphql_query,
-                    "variables": {"searchTerm": search, "cursor": cursor}
-                }
-
-                bearer_token = "bearer {token}".format(token=github_token)
-                response = requests.post(apiUrl,
-                                         data=json.dumps(data),
-                                         headers={"accept": "application/json",
-                                                  "Authorization": bearer_token})
-                r = response.json()
-
-                the_json = []
-                search_section = r["data"]["search"]
-                for node in search_section["nodes"]:
-                    languages = [n["name"] for n in node["languages"]["nodes"]]
-                    default_branch_ref = node.get("defaultBranchRef") if node.get("defaultBranchRef") else {}
-                    full_name = "{login}/{name}".format(name=node["name"], login=node["owner"]["login"])
-
-                    if not node["isPrivate"]:
-                        params = {
-                            "id": node["databaseId"],
-                            "isPrivate": node["isPrivate"],
-                            "name": node["name"],
-                            "full_name": full_name,
-                            "created_at": node["createdAt"],
-                            "pushed_at": node["pushedAt"],
-                            "updated_at": node["updatedAt"],
-                            "size": node["diskUsage"],
-                            "homepage": node["homepageUrl"],
-                            "stargazers_count": node["forks"]["totalCount"],
-                            "forks_count": node["stargazers"]["totalCount"],
-                            "watchers": node["watchers"]["totalCount"],
-                            "owner": {
-                                "id": node["owner"].get("databaseId", ""),
-                                "login": node["owner"]["login"],
-                                "avatarUrl": node["owner"]["avatarUrl"],
-                                "name": node["owner"].get("name", ""),
-                                "type": node["owner"]["__typename"],
-                                "location": node["owner"].get("location", "")
-                            },
-                            "default_branch": default_branch_ref.get("name", ""),
-                            "open_issues": node["issues"]["totalCount"],
-                            "description": node["description"],
-                            "html_url": node["url"],
-                            "language": languages[0] if len(languages) > 0 else ""
-                        }
-
-                        the_json.append(params)
-                    else:
-                        print("Skipping private repository", full_name)
-
-                has_more = search_section["pageInfo"]["hasNextPage"]
-                cursor = search_section["pageInfo"]["endCursor"]
-
-                result = session.run(import_query, {"json": {"items": the_json}})
-                print(result.consume().counters)
-
-                reset_at = r["data"]["rateLimit"]["resetAt"]
-                time_until_reset = (parse(reset_at) - datetime.datetime.now(timezone.utc)).total_seconds()
-
-                if r["data"]["rateLimit"]["remaining"] <= 0:
-                    time.sleep(time_until_reset)
-
-                print("Reset at:", time_until_reset,
-                      "has_more", has_more,
-                      "cursor", cursor,
-                      "repositoryCount", search_section["repositoryCount"])
+            slices = partition(tag, github_token, from_date, now)
+            changes = ChangeFilter("Repository")
+            failed = []
+            sources = [lambda search=search: fetch_slice(search, github_token, failed) for search in slices]
+
+            def write(the_json):
+                with metrics.stage("write") as written:
+                    written.counters = session.write_transaction(write_repositories, the_json, changes)
+                    written.records = len(the_json)
+
+            # Slices finish out of order, so the watermark only moves once all of them are written.
+            run_pipeline(interleave(sources, workers), transform_repositories, write)
+            if len(failed) > 0:
+                raise Exception("GitHub import failed for {0} of {1} slices: {2}".format(
+                    len(failed), len(slices), ", ".join("{0}: {1!r}".format(search, e) for search, e in failed)))
+            save_checkpoint(session, watermark, format_date(now))
+
+
+def fetch_slice(search, github_token, failed):
+    try:
+        yield from fetch_repositories(search, github_token)
+    except Exception as e:
+        failed.append((search, e))
+        raise
+
+
+def format_date(date):
+    return date.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def search_term(tag, start, end):
+    return "{tag} pushed:{start}..{end}".format(tag=tag, start=format_date(start), end=format_date(end))
+
+
+def partition(tag, github_token, start, end, min_span=datetime.timedelta(hours=1)):
+    search = search_term(tag, start, end)
+    count = graphql(github_token, count_query, {"searchTerm": search})["data"]["search"]["repositoryCount"]
+    print("Slice", search, "repositoryCount", count)
+
+    if count == 0:
+        return []
+    if count < search_limit or end - start <= min_span:
+        return [search]
+
+    middle = (start + (end - start) / 2).replace(microsecond=0)
+    return partition(tag, github_token, start, middle, min_span) + partition(tag, github_token, middle, end, min_span)
+
+
+def graphql(github_token, query, variables):
+    apiUrl = "https://api.github.com/graphql"
+
+    data = {
+        "query": query,
+        "variables": variables
+    }
+
+    bearer_token = "bearer {token}".format(token=github_token)
+    limiter("github").acquire()
+    with metrics.stage("fetch") as fetched:
+        response = http_session(apiUrl).post(apiUrl,
+                                             data=json.dumps(data),
+                                             headers={"accept": "application/json",
+                                                      "Authorization": bearer_token})
+        fetched.bytes = len(response.content)
+    with metrics.stage("decode") as decoded:
+        r = response.json()
+        decoded.records = len(((r.get("data") or {}).get("search") or {}).get("nodes") or [])
+
+    reset_at = r["data"]["rateLimit"]["resetAt"]
+    time_until_reset = (parse(reset_at) - datetime.datetime.now(timezone.utc)).total_seconds()
+    limiter("github").update(remaining=r["data"]["rateLimit"]["remaining"],
+                             reset_at=time.time() + time_until_reset)
+    return r
+
+
+def fetch_repositories(search, github_token):
+    cursor = None
+    has_more = True
+
+    while has_more:
+        r = graphql(github_token, graphql_query, {"searchTerm": search, "cursor": cursor})
+        yield r
+
+        search_section = r["data"]["search"]
+        has_more = search_section["pageInfo"]["hasNextPage"]
+        cursor = search_section["pageInfo"]["endCursor"]
+
+        print("Remaining:", r["data"]["rateLimit"]["remaining"],
+              "has_more", has_more,
+              "cursor", cursor,
+              "repositoryCount", search_section["repositoryCount"])
+
+
+def transform_repositories(r):
+    the_json = []
+    for node in r["data"]["search"]["nodes"]:
+        languages = [n["name"] for n in node["languages"]["nodes"]]
+        default_branch_ref = node.get("defaultBranchRef") if node.get("defaultBranchRef") else {}
+        full_name = "{login}/{name}".format(name=node["name"], login=node["owner"]["login"])
+
+        if not node["isPrivate"]:
+            params = {
+                "id": node["databaseId"],
+                "isPrivate": node["isPrivate"],
+                "name": node["name"],
+                "full_name": full_name,
+                "created_at": node["createdAt"],
+                "pushed_at": node["pushedAt"],
+                "updated_at": node["updatedAt"],
+                "size": node["diskUsage"],
+                "homepage": node["homepageUrl"],
+                "stargazers_count": node["forks"]["totalCount"],
+                "forks_count": node["stargazers"]["totalCount"],
+                "watchers": node["watchers"]["totalCount"],
+                "owner": {
+                    "id": node["owner"].get("databaseId", ""),
+                    "login": node["owner"]["login"],
+                    "avatarUrl": node["owner"]["avatarUrl"],
+                    "name": node["owner"].get("name", ""),
+                    "type": node["owner"]["__typename"],
+                    "location": node["owner"].get("location", "")
+                },
+                "default_branch": default_branch_ref.get("name", ""),
+                "open_issues": node["issues"]["totalCount"],
+                "description": node["description"],
+                "html_url": node["url"],
+                "language": languages[0] if len(languages) > 0 else ""
+            }
+
+            the_json.append(params)
+        else:
+            print("Skipping private repository", full_name)
+    return the_json
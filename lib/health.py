@@ -0,0 +1,128 @@
+import os
+import sqlite3
+import threading
+import time
+
+load_hosts_query = """\
+MATCH (host:Host)
+RETURN host.name AS name, host.failures AS failures, host.latency AS latency, host.lastSuccess AS lastSuccess,
+       host.lastFailure AS lastFailure, host.retryAt AS retryAt
+"""
+
+save_hosts_query = """\
+UNWIND {rows} AS row
+MERGE (host:Host {name:row[0]})
+SET host.failures = row[1], host.latency = row[2], host.lastSuccess = row[3], host.lastFailure = row[4],
+    host.retryAt = row[5]
+"""
+
+evict_hosts_query = """\
+MATCH (host:Host)
+WHERE coalesce(host.lastSuccess, 0) < {cutoff} AND coalesce(host.lastFailure, 0) < {cutoff}
+DELETE host
+RETURN count(*) AS evicted
+"""
+
+
+class GraphHosts:
+    # Scheduled functions mostly start cold, so host rows live in the graph rather than the container's /tmp.
+    def load(self, runner):
+        return {record["name"]: [record["failures"], record["latency"], record["lastSuccess"],
+                                 record["lastFailure"], record["retryAt"]]
+                for record in runner.run(load_hosts_query)}
+
+    def save(self, runner, rows):
+        runner.run(save_hosts_query, {"rows": rows}).consume()
+
+    def evict(self, runner, cutoff):
+        return runner.run(evict_hosts_query, {"cutoff": cutoff}).single()["evicted"]
+
+    def close(self):
+        pass
+
+
+class SqliteHosts:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS hosts (host TEXT PRIMARY KEY, failures INTEGER, latency REAL, "
+            "last_success REAL, last_failure REAL, retry_at REAL)")
+
+    def load(self, runner):
+        return {row[0]: list(row[1:]) for row in self.connection.execute("SELECT * FROM hosts")}
+
+    def save(self, runner, rows):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO hosts VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def evict(self, runner, cutoff):
+        with self.connection:
+            return self.connection.execute(
+                "DELETE FROM hosts WHERE max(coalesce(last_success, 0), coalesce(last_failure, 0)) < ?",
+                (cutoff,)).rowcount
+
+    def close(self):
+        self.connection.close()
+
+
+def host_store(location=None):
+    location = location or os.environ.get("HOST_HEALTH", "graph")
+    if location == "graph":
+        return GraphHosts()
+    if location.startswith("sqlite:"):
+        return SqliteHosts(location[len("sqlite:"):])
+    raise Exception("Unknown host health store {0}".format(location))
+
+
+class HostHealth:
+    def __init__(self, runner, location=None, ttl=7 * 24 * 60 * 60, base_backoff=15 * 60, max_backoff=24 * 60 * 60):
+        self.runner = runner
+        self.ttl = ttl
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.store = host_store(location)
+        # Workers report outcomes from many threads, so keep the rows in memory and write them back in save().
+        self.hosts = self.store.load(runner)
+        self.changed = set()
+
+    def retry_at(self, host):
+        with self.lock:
+            row = self.hosts.get(host)
+            if row is None or row[4] is None or row[4] <= time.time():
+                return None
+            return row[4]
+
+    def succeeded(self, host, latency):
+        with self.lock:
+            row = self.hosts.get(host) or [0, None, None, None, None]
+            average = latency if row[1] is None else 0.8 * row[1] + 0.2 * latency
+            self.hosts[host] = [0, average, time.time(), row[3], None]
+            self.changed.add(host)
+
+    def failed(self, host):
+        with self.lock:
+            now = time.time()
+            row = self.hosts.get(host) or [0, None, None, None, None]
+            failures = row[0] + 1
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** (failures - 1))
+            self.hosts[host] = [failures, row[1], row[2], now, now + backoff]
+            self.changed.add(host)
+
+    def save(self):
+        with self.lock:
+            rows = [[host] + self.hosts[host] for host in self.changed]
+            self.changed = set()
+        if len(rows) > 0:
+            self.store.save(self.runner, rows)
+
+    def evict(self):
+        cutoff = time.time() - self.ttl
+        evicted = self.store.evict(self.runner, cutoff)
+        with self.lock:
+            self.hosts = {host: row for host, row in self.hosts.items()
+                          if max(row[2] or 0, row[3] or 0) >= cutoff or host in self.changed}
+        return evicted
+
+    def close(self):
+        self.store.close()
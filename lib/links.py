@@ -0,0 +1,271 @@
+import http.client
+import socket
+import time
+
+import requests
+
+import lib.metrics as metrics
+from lib.checkpoint import load_checkpoint, save_checkpoint
+from lib.health import HostHealth
+from lib.pool import map_concurrently, host_of
+from lib.resolver import ConnectionPool, RedirectCache, resolve
+from lib.resources import graph_driver, new_session
+from lib.schema import ensure_schema
+from lib.titles import fetch_head
+from lib.urls import canonical_url
+
+pending = "pending"
+done = "done"
+
+migrate_link_state_query = """\
+MATCH (link:Link)
+WHERE NOT exists(link.state)
+WITH link LIMIT {limit}
+SET link.state = CASE
+  WHEN exists(link.short) OR NOT exists(link.title) OR NOT exists(link.cleanUrl) THEN "pending"
+  WHEN link.title = "N/A" AND coalesce(link.attempts, 1) < {max_attempts} THEN "pending"
+  ELSE "done" END
+RETURN count(*) AS migrated
+"""
+
+pending_links_query = """\
+MATCH (link:Link {state:"pending"})
+WHERE coalesce(link.retryAt, 0) <= timestamp() / 1000
+RETURN id(link) AS id, link.url AS url, exists(link.short) AS short, coalesce(link.attempts, 0) AS attempts
+ORDER BY id DESC
+LIMIT {limit}
+"""
+
+update_links_query = """\
+UNWIND {data} AS row
+MATCH (link) WHERE id(link) = row.id
+SET link.state = row.state, link.retryAt = row.retryAt
+FOREACH (_ IN CASE WHEN row.url IS NULL THEN [] ELSE [1] END |
+  SET link.url = row.url
+  REMOVE link.short
+)
+FOREACH (_ IN CASE WHEN row.clean IS NULL THEN [] ELSE [1] END | SET link.cleanUrl = row.clean)
+FOREACH (_ IN CASE WHEN row.title IS NULL THEN [] ELSE [1] END |
+  SET link.title = row.title, link.canonical = row.canonical, link.attempts = row.attempts
+)
+"""
+
+
+def migrate_link_state(session, max_attempts, batch_size=10000):
+    # Links imported before the state property existed are classified once, then the checkpoint skips the scan.
+    if load_checkpoint(session, "links:state", False):
+        return
+    migrated = batch_size
+    while migrated == batch_size:
+        migrated = session.run(migrate_link_state_query,
+                               {"limit": batch_size, "max_attempts": max_attempts}).single()["migrated"]
+        print("links migrated", migrated)
+    save_checkpoint(session, "links:state", True)
+
+
+def process_links(neo4j_url, neo4j_user, neo4j_pass, limit=1000, unshorten_workers=20, hydrate_workers=20,
+                  per_host=2, batch_size=200, max_attempts=4, retry_unresolved=60 * 60):
+    with graph_driver(neo4j_url, neo4j_user, neo4j_pass) as driver:
+        with driver.session() as session:
+            ensure_schema(session, "twitter")
+            migrate_link_state(session, max_attempts)
+            links = [{"id": record["id"], "url": record["url"], "short": record["short"],
+                      "attempts": record["attempts"]} for record in session.run(pending_links_query, {"limit": limit})]
+
+            cache = RedirectCache(session)
+            health = HostHealth(session)
+            pool = ConnectionPool(timeout=5.0)
+            # Link hosts are mostly one-offs, so pages share one session per run that keeps at most one small
+            # connection pool per worker and is closed at the end.
+            pages = new_session(pool_connections=hydrate_workers, pool_maxsize=per_host)
+            try:
+                print("evicted", cache.evict(), "hosts evicted", health.evict())
+                ready = []
+                unresolved = []
+                cached_urls = cache.get_all([link["url"] for link in links if link["short"]])
+                for link in links:
+                    cached = cached_urls.get(link["url"]) if link["short"] else None
+                    if cached is not None:
+                        ready.append(dict(link, url=cached, resolved=True))
+                    elif link["short"]:
+                        unresolved.append(link)
+                    else:
+                        ready.append(link)
+                resolved = {}
+
+                def unshorten(link):
+                    try:
+                        url, final = unshorten_link(link, pool, health)
+                    except Exception as e:
+                        print("Failed to unshorten {0}: {1!r}".format(link["url"], e))
+                        return dict(link, failed=True)
+                    if final is None:
+                        return dict(link, retryAt=health.retry_at(host_of(url)) or time.time() + retry_unresolved)
+                    resolved[url] = canonical_url(final)
+                    return dict(link, url=resolved[url], resolved=True)
+
+                def unshortened():
+                    for link in ready:
+                        yield link
+                    for link in map_concurrently(unshorten, unresolved, key=lambda link: host_of(link["url"]),
+                                                 workers=unshorten_workers, per_host=per_host):
+                        yield link
+
+                def hydrate(link):
+                    if "retryAt" in link:
+                        return {"id": link["id"], "state": pending, "retryAt": link["retryAt"]}
+                    # An unexpected error counts as an N/A attempt for that link only, so one bad url can
+                    # neither abort the run nor stay at the head of the pending queue.
+                    try:
+                        row = not_available(link) if link.get("failed") else hydrate_link(link, health, pages)
+                    except Exception as e:
+                        print("Failed to hydrate {0}: {1!r}".format(link["url"], e))
+                        row = not_available(link)
+                    row["state"] = pending if row.get("retryAt") is not None else done
+                    if row.get("title") == "N/A" and row["attempts"] >= max_attempts:
+                        row["state"], row["retryAt"] = done, None
+                    row["url"] = link["url"] if link.get("resolved") else None
+                    row["clean"] = canonical_url(link["url"])
+                    return row
+
+                # Each link is unshortened, canonicalized and hydrated once, in that order, with its own worker pool
+                # per stage; rows are written as they come out of the last stage.
+                rows = []
+                for row in map_concurrently(hydrate, unshortened(), key=lambda link: host_of(link["url"]),
+                                            workers=hydrate_workers, per_host=per_host):
+                    rows.append(row)
+                    if len(rows) >= batch_size:
+                        write_links(session, rows)
+                        rows = []
+                if len(rows) > 0:
+                    write_links(session, rows)
+
+                cache.put_all(resolved)
+                health.save()
+            finally:
+                pages.close()
+                pool.close()
+                cache.close()
+                health.close()
+
+            print("links", len(links), "unshortened", len(resolved))
+
+
+def write_links(session, rows):
+    with metrics.stage("write") as written:
+        written.counters = session.write_transaction(update_links, rows)
+        written.records = len(rows)
+
+
+def update_links(tx, rows):
+    return tx.run(update_links_query, {"data": [dict({"url": None, "clean": None, "title": None, "canonical": None,
+                                                      "attempts": None}, **row) for row in rows]}).consume().counters
+
+
+def unshorten_link(link, pool=None, health=None):
+    host = host_of(link["url"])
+    if health is not None and health.retry_at(host) is not None:
+        metrics.add("deferred", 0, records=1)
+        return link["url"], None
+
+    start = time.time()
+    try:
+        with metrics.stage("fetch") as fetched:
+            fetched.records = 1
+            final = unshorten_url(link["url"], pool)
+        if health is not None:
+            health.succeeded(host, time.time() - start)
+        return link["url"], final
+    except http.client.InvalidURL:
+        # Left for hydration to record as a permanent N/A rather than counted against the host.
+        print("Invalid url {0}. Skipping".format(link["url"]))
+        return link["url"], link["url"]
+    except AttributeError:
+        print("Failed to resolve {0}. Ignoring for now".format(link["url"]))
+    except socket.gaierror:
+        print("Failed to resolve {0}. Ignoring for now".format(link["url"]))
+        if health is not None:
+            health.failed(host)
+    except (socket.error, http.client.HTTPException):
+        print("Failed to connect to {0}. Ignoring for now".format(link["url"]))
+        if health is not None:
+            health.failed(host)
+    return link["url"], None
+
+
+def unshorten_url(url, pool=None):
+    if url is None or len(url) < 11:
+        return url
+    return resolve(url, pool or ConnectionPool(timeout=5.0))
+
+
+def hydrate_link(link, health=None, session=requests, retry_after=24 * 60 * 60):
+    # Links on hosts that recently failed wait for the host's backoff; links without a title are
+    # retried with their own backoff instead of being marked "N/A" for good.
+    host = host_of(link["url"])
+    retry_at = health.retry_at(host) if health is not None else None
+    if retry_at is not None:
+        return {"id": link["id"], "retryAt": retry_at}
+
+    start = time.time()
+    try:
+        print("Processing {0}".format(link["url"]))
+        page = hydrate_page(link["url"], session)
+        if health is not None:
+            if page["reachable"]:
+                health.succeeded(host, time.time() - start)
+            else:
+                health.failed(host)
+        if page["title"] != "N/A":
+            return {"id": link["id"], "title": page["title"], "canonical": page["canonical"], "attempts": 0,
+                    "retryAt": None}
+    except (requests.exceptions.InvalidSchema, requests.exceptions.MissingSchema, requests.exceptions.InvalidURL):
+        # These subclass IOError but say nothing about the host, e.g. an itms-apps:// redirect target.
+        print("Invalid url {0}. Skipping".format(link["url"]))
+        return {"id": link["id"], "title": "N/A", "canonical": None, "attempts": link.get("attempts", 0) + 1,
+                "retryAt": None}
+    except AttributeError:
+        print("Failed to resolve {0}. Ignoring for now".format(link["url"]))
+    except socket.gaierror:
+        print("Failed to resolve {0}. Ignoring for now".format(link["url"]))
+        if health is not None:
+            health.failed(host)
+    except socket.error:
+        print("Failed to connect to {0}. Ignoring for now".format(link["url"]))
+        if health is not None:
+            health.failed(host)
+
+    return not_available(link, retry_after)
+
+
+def not_available(link, retry_after=24 * 60 * 60):
+    attempts = link.get("attempts", 0) + 1
+    return {"id": link["id"], "title": "N/A", "canonical": None, "attempts": attempts,
+            "retryAt": time.time() + retry_after * 2 ** (attempts - 1)}
+
+
+def hydrate_url(url, session=requests):
+    return hydrate_page(url, session)["title"]
+
+
+def hydrate_page(url, session=requests):
+    head = None
+    reachable = True
+    try:
+        if url:
+            with metrics.stage("fetch") as fetched:
+                fetched.records = 1
+                head = fetch_head(url, session=session, timeout=5.0)
+    except requests.exceptions.ConnectionError:
+        print("Failed to connect: ", url)
+        reachable = False
+    except requests.exceptions.ReadTimeout:
+        print("Read timed out: ", url)
+        reachable = False
+
+    title = head and (head["title"] or head["og_title"])
+    if not title:
+        print("Skipping: ", url)
+        return {"title": "N/A", "canonical": None, "reachable": reachable}
+    else:
+        return {"title": title, "canonical": head["canonical"], "reachable": reachable}
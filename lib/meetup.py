@@ -1,7 +1,11 @@
 import time
-import requests
 
-from neo4j.v1 import GraphDatabase, basic_auth
+from lib.digest import ChangeFilter
+import lib.metrics as metrics
+from lib.pipeline import run_pipeline, interleave
+from lib.ratelimit import limiter
+from lib.resources import graph_driver, http_session
+from lib.schema import ensure_schema
 
 import_meetup_events_query = """
 UNWIND {json} as e
@@ -13,7 +17,8 @@ event.link=e.event_url,event.time=e.time,
 event.utc_offset=e.utc_offset,event.duration=e.duration
 SET event.updated=e.updated,event.headcount=e.headcount,event.waitlist_count=e.waitlist_count,
 event.maybe_rsvp_count=e.maybe_rsvp_count,event.yes_rsvp_count=e.yes_rsvp_count,event.rsvp_limit=e.rsvp_limit,
-event.announced=e.announced,event.comment_count=e.comment_count,event.status=e.status,event.rating=e.rating.average,event.ratings=e.rating.count
+event.announced=e.announced,event.comment_count=e.comment_count,event.status=e.status,event.rating=e.rating.average,event.ratings=e.rating.count,
+event.digest=e.digest
 MERGE (g)-[:CONTAINED]->(event)
 FOREACH (o in coalesce(e.event_hosts,[]) |
   MERGE (host:User:Meetup {id:o.member_id}) ON CREATE SET host.name = o.member_name
@@ -31,7 +36,7 @@ import_meetup_groups_query = """
 UNWIND {json} as g
 MERGE (group:Group:Meetup:Container {id:g.id}) 
   ON CREATE SET group.title=g.name,group.text=g.description,group.key=g.urlname,group.country=g.country,group.city=g.city,group.created=g.created,group.link=g.link,group.longitude=g.lon,group.latitude=g.lat,group.members=g.members
-SET group.rating=g.rating
+SET group.rating=g.rating, group.digest=g.digest
 FOREACH (organizer IN [o in [g.organizer] WHERE g.organizer IS NOT NULL] |
   MERGE (owner:User:Meetup {id:organizer.member_id}) ON CREATE SET owner.name = organizer.name
   MERGE (owner)-[:CREATED]->(group)
@@ -43,21 +48,22 @@ SET group:Graph
 """
 
 
-def import_events(neo4j_url, neo4j_user, neo4j_pass, meetup_key):
+def import_events(neo4j_url, neo4j_user, neo4j_pass, meetup_key, shard_size=50, workers=4):
     if len(meetup_key) == 0:
         raise (Exception("No Meetup API Key configured"))
 
-    with GraphDatabase.driver(neo4j_url, auth=basic_auth(neo4j_user, neo4j_pass)) as driver:
+    with graph_driver(neo4j_url, neo4j_user, neo4j_pass) as driver:
         with driver.session() as session:
+            ensure_schema(session, "meetup")
             groups = []
             result = session.run("MATCH (g:Group:Meetup) RETURN g.id as id, g.key as key")
             for record in result:
                 if record["id"] != None:
                     group = record["id"]
                     groups += [str(group)]
-            event_url = "https://api.meetup.com/2/events?group_id={groups}&status=upcoming,past&text_format=plain&order=time&omit=fee,photo_sample,rsvp_rules,rsvp_sample&fields=event_hosts".format(
-                groups=",".join(groups))
-            run_import("events", event_url, session, import_meetup_events_query, meetup_key, {})
+            event_urls = ["https://api.meetup.com/2/events?group_id={groups}&status=upcoming,past&text_format=plain&order=time&omit=fee,photo_sample,rsvp_rules,rsvp_sample&fields=event_hosts".format(
+                groups=",".join(groups[start:start + shard_size])) for start in range(0, len(groups), shard_size)]
+            run_import("events", event_urls, session, import_meetup_events_query, meetup_key, {}, ChangeFilter("Event"), workers)
 
 
 def import_groups(neo4j_url, neo4j_user, neo4j_pass, tag, meetup_key):
@@ -66,39 +72,76 @@ def import_groups(neo4j_url, neo4j_user, neo4j_pass, tag, meetup_key):
     if len(tag) == 0:
         raise Exception("No tag configured")
 
-    with GraphDatabase.driver(neo4j_url, auth=basic_auth(neo4j_user, neo4j_pass)) as driver:
+    with graph_driver(neo4j_url, neo4j_user, neo4j_pass) as driver:
         with driver.session() as session:
+            ensure_schema(session, "meetup")
             group_url = "https://api.meetup.com/2/groups?topic={tag}&radius=36000&text_format=plain&order=id&omit=contributions,group_photo,approved,join_info,membership_dues,self,similar_groups,sponsors,simple_html_description,welcome_message".format(tag=tag)
-            run_import("groups", group_url, session, import_meetup_groups_query, meetup_key, {})
+            run_import("groups", [group_url], session, import_meetup_groups_query, meetup_key, {}, ChangeFilter("Group"))
 
 
-def run_import(type, url, session, query, meetup_key, params):
+def run_import(type, urls, session, query, meetup_key, params, changes, workers=1):
+    def transform(results):
+        if len(results) > 0:
+            p = {"json": results}
+            p.update(params)
+            return p
+
+    def write(p):
+        with metrics.stage("write") as written:
+            written.counters = session.write_transaction(write_results, query, p, changes)
+            written.records = len(p["json"])
+
+    failed = []
+    shards = [lambda url=url: fetch_shard(type, url, meetup_key, failed) for url in urls]
+    run_pipeline(interleave(shards, workers), transform, write)
+    # A failing shard does not stop the others, but the import still fails once they are written.
+    if len(failed) > 0:
+        raise Exception("Meetup {0} import failed for {1} of {2} shards: {3}".format(
+            type, len(failed), len(urls), ", ".join("{0}: {1!r}".format(url, e) for url, e in failed)))
+
+
+def fetch_shard(type, url, meetup_key, failed):
+    try:
+        yield from fetch_pages(type, url, meetup_key)
+    except Exception as e:
+        failed.append((url, e))
+        raise
+
+
+def fetch_pages(type, url, meetup_key):
     page = 0
     has_more = True
     items = 100
 
     while has_more:
+        limiter("meetup").acquire()
         api_url = url + "&key={key}&offset={offset}&page={items}".format(key=meetup_key, offset=page, items=items)
 
-        response = requests.get(api_url, headers={"accept": "application/json"})
+        with metrics.stage("fetch") as fetched:
+            response = http_session(api_url).get(api_url, headers={"accept": "application/json"})
+            fetched.bytes = len(response.content)
         if response.status_code != 200:
             print(response.text)
 
         rate_remain = int(response.headers['X-RateLimit-Remaining'])
         rate_reset = int(response.headers['X-RateLimit-Reset'])
+        limiter("meetup").update(remaining=rate_remain, reset_at=time.time() + rate_reset)
 
-        json = response.json()
-        meta = json['meta']
-        results = json.get("results", [])
+        with metrics.stage("decode") as decoded:
+            json = response.json()
+            meta = json['meta']
+            results = json.get("results", [])
+            decoded.records = len(results)
         has_more = len(meta.get("next", "")) > 0
         if len(results) > 0:
-            p = {"json": results}
-            p.update(params)
-            result = session.run(query, p)
-            print(result.consume().counters)
             page = page + 1
+        yield results
 
         print(type, "results", len(results), "has_more", has_more, "quota", rate_remain, "reset (s)", rate_reset, "page", page)
-        time.sleep(1)
-        if rate_remain <= 0:
-            time.sleep(rate_reset)
+
+
+def write_results(tx, query, params, changes):
+    results = changes.changed(tx, params["json"])
+    if len(results) == 0:
+        return {}
+    return tx.run(query, dict(params, json=results)).consume().counters
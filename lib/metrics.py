@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+metrics_file = os.environ.get("METRICS_FILE")
+
+lock = threading.Lock()
+stages = {}
+current = {"invocation": None}
+
+
+class Measured:
+    def __init__(self):
+        self.records = 0
+        self.bytes = 0
+        self.counters = None
+
+
+def counter_values(counters):
+    if counters is None:
+        return {}
+    values = counters if isinstance(counters, dict) else vars(counters)
+    return {name: value for name, value in values.items()
+            if isinstance(value, int) and not isinstance(value, bool) and value != 0}
+
+
+def add(name, seconds, records=0, bytes=0, counters=None):
+    with lock:
+        totals = stages.get(name)
+        if totals is None:
+            totals = stages[name] = {"calls": 0, "seconds": 0.0, "records": 0, "bytes": 0, "counters": Counter()}
+        totals["calls"] += 1
+        totals["seconds"] += seconds
+        totals["records"] += records
+        totals["bytes"] += bytes
+        totals["counters"].update(counter_values(counters))
+
+
+@contextmanager
+def stage(name):
+    measured = Measured()
+    start = time.perf_counter()
+    try:
+        yield measured
+    finally:
+        add(name, time.perf_counter() - start, measured.records, measured.bytes, measured.counters)
+
+
+def timed(name, fn, *args):
+    with stage(name):
+        return fn(*args)
+
+
+def report():
+    with lock:
+        return [{"invocation": current["invocation"], "stage": name, "calls": totals["calls"],
+                 "seconds": round(totals["seconds"], 3), "records": totals["records"], "bytes": totals["bytes"],
+                 "counters": dict(totals["counters"])}
+                for name, totals in sorted(stages.items())]
+
+
+def emit(records):
+    lines = [json.dumps(record, sort_keys=True) for record in records]
+    for line in lines:
+        print(line)
+    if metrics_file:
+        with open(metrics_file, "a") as file:
+            file.write("".join(line + "\n" for line in lines))
+
+
+@contextmanager
+def invocation(name):
+    # Stages overlap when importers pipeline fetches and writes, so their seconds can add up to more than "total".
+    with lock:
+        stages.clear()
+        current["invocation"] = name
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add("total", time.perf_counter() - start)
+        emit(report())
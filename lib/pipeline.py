@@ -0,0 +1,114 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import lib.metrics as metrics
+
+done = object()
+
+
+class StageFailed:
+    def __init__(self, error):
+        self.error = error
+
+
+def run_stage(source, fn, output, stop):
+    try:
+        for item in source:
+            if stop.is_set():
+                return
+            result = fn(item)
+            if result is not None:
+                put(output, result, stop)
+    except Exception as e:
+        put(output, StageFailed(e), stop)
+    finally:
+        # Closing a generator source runs its cleanup, e.g. stopping interleave's producers.
+        close = getattr(source, "close", None)
+        if close is not None:
+            close()
+        put(output, done, stop)
+
+
+def put(output, item, stop):
+    while not stop.is_set():
+        try:
+            output.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def drain(input):
+    while True:
+        item = input.get()
+        if item is done:
+            return
+        if isinstance(item, StageFailed):
+            raise item.error
+        yield item
+
+
+def run_pipeline(pages, transform, write, depth=2):
+    stop = threading.Event()
+    fetched = queue.Queue(maxsize=depth)
+    transformed = queue.Queue(maxsize=depth)
+
+    def timed_transform(page):
+        return metrics.timed("transform", transform, page)
+
+    stages = [threading.Thread(target=run_stage, args=(pages, lambda page: page, fetched, stop), daemon=True),
+              threading.Thread(target=run_stage, args=(drain(fetched), timed_transform, transformed, stop), daemon=True)]
+    for stage in stages:
+        stage.start()
+
+    written = 0
+    try:
+        for batch in drain(transformed):
+            write(batch)
+            written += 1
+    except BaseException:
+        stop.set()
+        raise
+
+    for stage in stages:
+        stage.join()
+    return written
+
+
+source_done = object()
+
+
+def interleave(sources, workers):
+    stop = threading.Event()
+    pages = queue.Queue(maxsize=workers * 2)
+
+    def drain_source(source):
+        try:
+            for page in source():
+                if stop.is_set():
+                    return
+                put(pages, page, stop)
+        except Exception as e:
+            print("Source failed", e)
+        finally:
+            put(pages, source_done, stop)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = [executor.submit(drain_source, source) for source in sources]
+
+    try:
+        remaining = len(sources)
+        while remaining > 0:
+            page = pages.get()
+            if page is source_done:
+                remaining -= 1
+            else:
+                yield page
+    finally:
+        # Runs when the consumer stops early too, so producers blocked on a full queue give up instead of
+        # keeping their threads alive.
+        stop.set()
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
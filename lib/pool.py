@@ -0,0 +1,101 @@
+import collections
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+
+def host_of(url):
+    if not url:
+        return ""
+    try:
+        return urlparse(url).netloc.lower()
+    except ValueError:
+        return ""
+
+
+class Submitted:
+    def __init__(self, count, error=None):
+        self.count = count
+        self.error = error
+
+
+def map_concurrently(fn, items, key=host_of, workers=20, per_host=2):
+    completed = queue.Queue()
+    lock = threading.Lock()
+    waiting = collections.defaultdict(collections.deque)
+    active = collections.Counter()
+    runnable = collections.deque()
+    running = [0]
+
+    # At most `workers` items are handed to the pool, each from a host that is below its limit, so a busy host
+    # never ties up workers other hosts could use. Hosts with a backlog go first when one of their items finishes,
+    # since they are the long pole of the run.
+    def dispatch():
+        started = []
+        while running[0] < workers and runnable:
+            host = runnable.popleft()
+            started.append((host, waiting[host].popleft()))
+            active[host] += 1
+            running[0] += 1
+            if waiting[host] and active[host] < per_host:
+                runnable.append(host)
+            elif not waiting[host]:
+                del waiting[host]
+        return started
+
+    def start(executor, started):
+        for host, item in started:
+            executor.submit(fn, item).add_done_callback(lambda future, host=host: finished(executor, host, future))
+
+    def schedule(executor, item):
+        host = key(item)
+        with lock:
+            if not waiting[host] and active[host] < per_host:
+                runnable.append(host)
+            waiting[host].append(item)
+            started = dispatch()
+        start(executor, started)
+
+    def finished(executor, host, future):
+        with lock:
+            active[host] -= 1
+            running[0] -= 1
+            if waiting.get(host) and active[host] == per_host - 1:
+                runnable.appendleft(host)
+            if active[host] == 0:
+                del active[host]
+            started = dispatch()
+        try:
+            start(executor, started)
+        except RuntimeError:
+            # The executor is shutting down because the consumer stopped early.
+            return
+        completed.put(future)
+
+    # Items are scheduled from their own thread, so a generator fed by another stage streams through
+    # instead of being drained before the first result comes back.
+    def submit_all(executor):
+        count = 0
+        try:
+            for item in items:
+                schedule(executor, item)
+                count += 1
+        except Exception as e:
+            completed.put(Submitted(count, e))
+        else:
+            completed.put(Submitted(count))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        threading.Thread(target=submit_all, args=(executor,), daemon=True).start()
+        submitted = None
+        received = 0
+        while submitted is None or received < submitted.count:
+            future = completed.get()
+            if isinstance(future, Submitted):
+                submitted = future
+                continue
+            received += 1
+            yield future.result()
+        if submitted.error is not None:
+            raise submitted.error
@@ -0,0 +1,48 @@
+import gzip
+import hashlib
+import io
+import os
+from urllib.parse import urlparse
+
+import boto
+import boto.s3.connection
+import boto.s3.key
+
+digest_metadata = "content-sha256"
+
+
+def s3_bucket(name):
+    endpoint = os.environ.get("S3_ENDPOINT")
+    if endpoint:
+        parsed = urlparse(endpoint)
+        connection = boto.connect_s3(host=parsed.hostname, port=parsed.port, is_secure=parsed.scheme == "https",
+                                     calling_format=boto.s3.connection.OrdinaryCallingFormat())
+    else:
+        connection = boto.connect_s3()
+    return connection.get_bucket(name)
+
+
+def compress(body):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=9, mtime=0) as file:
+        file.write(body)
+    return buffer.getvalue()
+
+
+def publish(bucket, key_name, body, digest=None, content_type="text/html; charset=utf-8",
+            cache_control="public, max-age=300"):
+    digest = digest or hashlib.sha256(body).hexdigest()
+
+    existing = bucket.get_key(key_name)
+    if existing is not None and existing.get_metadata(digest_metadata) == digest:
+        print("Unchanged", key_name, "skipped upload, bytes saved", len(body))
+        return {"uploaded": False, "bytes": 0, "bytes_saved": len(body)}
+
+    compressed = compress(body)
+    key = boto.s3.key.Key(bucket, key_name)
+    key.set_metadata(digest_metadata, digest)
+    key.set_contents_from_string(compressed, headers={"Content-Type": content_type,
+                                                      "Content-Encoding": "gzip",
+                                                      "Cache-Control": cache_control})
+    print("Uploaded", key_name, "bytes", len(compressed), "bytes saved", len(body) - len(compressed))
+    return {"uploaded": True, "bytes": len(compressed), "bytes_saved": len(body) - len(compressed)}
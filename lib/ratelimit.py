@@ -0,0 +1,80 @@
+import threading
+import time
+
+from lib.metrics import add as add_metric
+
+
+class RateLimitExhausted(Exception):
+    pass
+
+
+class RateLimiter:
+    def __init__(self, source, burst=20, reserve=1, max_wait=120):
+        self.source = source
+        self.burst = burst
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+
+        self.tokens = float(burst)
+        self.rate = None
+        self.remaining = None
+        self.reset_at = None
+        self.not_before = 0
+        self.updated = time.time()
+
+    def refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        else:
+            self.tokens = self.burst
+        self.updated = now
+
+    def delay(self, now):
+        delays = [0, self.not_before - now]
+        if self.remaining is not None and self.remaining <= self.reserve and self.reset_at is not None:
+            delays.append(self.reset_at - now)
+        if self.tokens < 1 and self.rate:
+            delays.append((1 - self.tokens) / self.rate)
+        return max(delays)
+
+    def acquire(self):
+        with self.lock:
+            now = time.time()
+            self.refill(now)
+            delay = self.delay(now)
+            if delay > self.max_wait:
+                raise RateLimitExhausted("{0} rate limit exhausted, next request in {1:.0f}s".format(self.source, delay))
+
+            self.tokens -= 1
+            if self.remaining is not None:
+                self.remaining -= 1
+
+        if delay > 0:
+            time.sleep(delay)
+            add_metric("sleep:" + self.source, delay, counters={"waits": 1})
+
+    def update(self, remaining=None, reset_at=None, backoff=None):
+        with self.lock:
+            now = time.time()
+            self.refill(now)
+            if remaining is not None:
+                self.remaining = remaining
+            if reset_at is not None:
+                self.reset_at = reset_at
+            if self.remaining is not None and self.reset_at is not None:
+                # Spread what is left of the quota evenly over the time until it resets.
+                self.rate = max(self.remaining - self.reserve, 0) / max(self.reset_at - now, 1)
+            if backoff is not None:
+                self.not_before = max(self.not_before, now + backoff)
+
+
+registry_lock = threading.Lock()
+limiters = {}
+
+
+def limiter(source, **config):
+    with registry_lock:
+        if source not in limiters:
+            limiters[source] = RateLimiter(source, **config)
+        return limiters[source]
@@ -0,0 +1,194 @@
+import http.client
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse, urljoin
+
+import lib.fixtures as fixtures
+
+
+class ConnectionPool:
+    def __init__(self, timeout=5.0, max_idle=4):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def acquire(self, scheme, netloc, fresh=False):
+        with self.lock:
+            connections = self.idle.get((scheme, netloc), [])
+            if connections and not fresh:
+                return connections.pop()
+        if fixtures.store is not None:
+            return fixtures.FixtureConnection(fixtures.store, scheme, netloc, self.timeout)
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def release(self, scheme, netloc, connection):
+        with self.lock:
+            connections = self.idle.setdefault((scheme, netloc), [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle = {}
+
+
+fresh_redirects_query = """\
+UNWIND {urls} AS url
+MATCH (redirect:Redirect {url:url})
+WHERE redirect.resolvedAt >= {cutoff}
+RETURN redirect.url AS url, redirect.resolved AS resolved
+"""
+
+save_redirects_query = """\
+UNWIND {rows} AS row
+MERGE (redirect:Redirect {url:row[0]})
+SET redirect.resolved = row[1], redirect.resolvedAt = row[2]
+"""
+
+evict_redirects_query = """\
+MATCH (redirect:Redirect)
+WHERE redirect.resolvedAt < {cutoff}
+WITH redirect LIMIT {limit}
+DELETE redirect
+RETURN count(*) AS evicted
+"""
+
+
+class GraphRedirects:
+    # Scheduled functions mostly start cold, so resolved short links live in the graph rather than /tmp.
+    def get_all(self, runner, urls, cutoff):
+        return {record["url"]: record["resolved"]
+                for record in runner.run(fresh_redirects_query, {"urls": urls, "cutoff": cutoff})}
+
+    def put_all(self, runner, rows):
+        runner.run(save_redirects_query, {"rows": rows}).consume()
+
+    def evict(self, runner, cutoff, batch_size=10000):
+        evicted = 0
+        deleted = batch_size
+        while deleted == batch_size:
+            deleted = runner.run(evict_redirects_query, {"cutoff": cutoff, "limit": batch_size}).single()["evicted"]
+            evicted += deleted
+        return evicted
+
+    def close(self):
+        pass
+
+
+class SqliteRedirects:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS redirects (url TEXT PRIMARY KEY, resolved TEXT, resolved_at REAL)")
+
+    def get_all(self, runner, urls, cutoff):
+        resolved = {}
+        for url in urls:
+            row = self.connection.execute("SELECT resolved FROM redirects WHERE url = ? AND resolved_at >= ?",
+                                          (url, cutoff)).fetchone()
+            if row is not None:
+                resolved[url] = row[0]
+        return resolved
+
+    def put_all(self, runner, rows):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO redirects VALUES (?, ?, ?)", rows)
+
+    def evict(self, runner, cutoff):
+        with self.connection:
+            return self.connection.execute("DELETE FROM redirects WHERE resolved_at < ?", (cutoff,)).rowcount
+
+    def close(self):
+        self.connection.close()
+
+
+def redirect_store(location=None):
+    location = location or os.environ.get("REDIRECT_CACHE", "graph")
+    if location == "graph":
+        return GraphRedirects()
+    if location.startswith("sqlite:"):
+        return SqliteRedirects(location[len("sqlite:"):])
+    raise Exception("Unknown redirect cache {0}".format(location))
+
+
+class RedirectCache:
+    def __init__(self, runner, location=None, ttl=30 * 24 * 60 * 60):
+        self.runner = runner
+        self.ttl = ttl
+        self.store = redirect_store(location)
+
+    def get_all(self, urls):
+        if len(urls) == 0:
+            return {}
+        return self.store.get_all(self.runner, urls, time.time() - self.ttl)
+
+    def put_all(self, resolved):
+        if len(resolved) == 0:
+            return
+        now = time.time()
+        self.store.put_all(self.runner, [[url, final, now] for url, final in resolved.items()])
+
+    def evict(self):
+        return self.store.evict(self.runner, time.time() - self.ttl)
+
+    def close(self):
+        self.store.close()
+
+
+def head(pool, parsed, path, timeout):
+    # A kept-alive connection may have been closed by the server while it sat idle, so a failure on a reused
+    # connection is retried once on a fresh one; only failures on fresh connections reach the caller.
+    for fresh in [False, True]:
+        connection = pool.acquire(parsed.scheme, parsed.netloc, fresh)
+        reused = connection.sock is not None
+        connection.timeout = min(pool.timeout, timeout)
+        if reused:
+            connection.sock.settimeout(connection.timeout)
+        try:
+            connection.request("HEAD", path)
+            response = connection.getresponse()
+            response.read()
+            return connection, response
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            if not reused:
+                raise
+
+
+def resolve(url, pool, max_hops=5, max_time=10.0, short_length=22):
+    deadline = time.time() + max_time
+    for _ in range(max_hops):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TimeoutError("Timed out resolving {0}".format(url))
+
+        parsed = urlparse(url)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        connection, response = head(pool, parsed, path, remaining)
+
+        location = response.getheader("Location")
+        if response.will_close:
+            connection.close()
+        else:
+            pool.release(parsed.scheme, parsed.netloc, connection)
+
+        if response.status // 100 != 3 or not location:
+            return url
+
+        location = urljoin(url, location)
+        if location == url or len(location) > short_length:
+            return location
+        url = location
+    return url
@@ -0,0 +1,90 @@
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+from neo4j.v1 import GraphDatabase, basic_auth, ServiceUnavailable, SessionExpired, ProtocolError
+
+import lib.fixtures as fixtures
+
+lock = threading.Lock()
+drivers = {}
+http_sessions = {}
+
+health_check_after = 30
+http_session_max_age = 15 * 60
+
+
+class PooledDriver:
+    def __init__(self, url, user, password):
+        self.password = password
+        self.driver = GraphDatabase.driver(url, auth=basic_auth(user, password))
+        self.last_used = time.time()
+        self.stale = False
+
+    def healthy(self):
+        if self.stale:
+            return False
+        if time.time() - self.last_used < health_check_after:
+            return True
+        try:
+            with self.driver.session() as session:
+                session.run("RETURN 1").consume()
+            return True
+        except Exception as e:
+            print("Neo4j driver failed health check", e)
+            return False
+
+
+def pooled_driver(url, user, password):
+    key = (url, user)
+    with lock:
+        pooled = drivers.get(key)
+        if pooled is not None and (pooled.password != password or not pooled.healthy()):
+            pooled.driver.close()
+            pooled = None
+        if pooled is None:
+            pooled = drivers[key] = PooledDriver(url, user, password)
+        pooled.last_used = time.time()
+        return pooled
+
+
+@contextmanager
+def graph_driver(url, user, password):
+    pooled = pooled_driver(url, user, password)
+    try:
+        yield pooled.driver
+    except (ServiceUnavailable, SessionExpired, ProtocolError, OSError):
+        pooled.stale = True
+        raise
+    finally:
+        pooled.last_used = time.time()
+
+
+def http_session(url):
+    # Only for the handful of API hosts; one-off hosts such as link targets would never be evicted.
+    host = urlparse(url).netloc.lower()
+    with lock:
+        created, session = http_sessions.get(host, (None, None))
+        if session is not None and time.time() - created > http_session_max_age:
+            session.close()
+            session = None
+        if session is None:
+            session = new_session()
+            http_sessions[host] = (time.time(), session)
+        return session
+
+
+def new_session(pool_connections=1, pool_maxsize=10):
+    session = requests.Session()
+    if fixtures.store is not None:
+        session.mount("https://", fixtures.FixtureAdapter(fixtures.store))
+        session.mount("http://", fixtures.FixtureAdapter(fixtures.store))
+    else:
+        session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=pool_connections,
+                                                                pool_maxsize=pool_maxsize))
+        session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=pool_connections,
+                                                               pool_maxsize=pool_maxsize))
+    return session
+
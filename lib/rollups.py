@@ -0,0 +1,110 @@
+from lib.checkpoint import load_checkpoint, save_checkpoint
+
+retweet_counts_query = """\
+UNWIND {ids} AS id
+MATCH (tweet:Tweet {id:id})
+SET tweet.retweets = size((tweet)<-[:RETWEETED]-())
+"""
+
+link_scores_query = """\
+UNWIND {ids} AS id
+MATCH (:Tweet {id:id})-[:LINKED]->(l:Link)
+WITH DISTINCT l
+MATCH (l)<-[:LINKED]-(t:Tweet:Content)
+WHERE NOT(t:Retweet) AND EXISTS(t.created)
+WITH l, t
+ORDER BY t.created
+WITH l, toInteger(t.created / 86400) AS day, collect(t) AS tweets
+MERGE (l)-[:SCORED]->(bucket:LinkDay {day:day})
+SET bucket.score = REDUCE(acc = 0, tweet IN tweets | acc + coalesce(tweet.favorites, 0) + coalesce(tweet.retweets, 0)),
+    bucket.first = tweets[0].created,
+    bucket.users = [tweet IN tweets | head([(tweet)<-[:POSTED]-(user) | user.screen_name])]
+WITH l, min(bucket.first) AS first
+SET l.firstTweeted = first
+"""
+
+twitter_activity_query = """\
+UNWIND {ids} AS id
+MATCH (user:User)-[:POSTED]->(t:Tweet {id:id})
+WHERE EXISTS(t.created)
+WITH DISTINCT user, toInteger(t.created / 86400) AS day
+MATCH (user)-[:POSTED]->(posted:Tweet)
+WHERE day * 86400 <= posted.created < (day + 1) * 86400
+WITH user, day, count(posted) AS posts
+MERGE (activity:Activity {key:"twitter:" + user.screen_name + "@" + day})
+ON CREATE SET activity.source = "twitter", activity.day = day
+SET activity.posts = posts
+MERGE (user)-[:ACTIVE]->(activity)
+"""
+
+so_activity_query = """\
+UNWIND {ids} AS id
+MATCH (:Question {id:id})<-[:ANSWERED]-(:Answer)<-[:POSTED]-(user)
+WITH DISTINCT user
+MATCH (user)-[:POSTED]->(:Answer)-->(question:Question)
+WHERE EXISTS(question.created)
+WITH user, toInteger(question.created / 86400) AS day, count(*) AS replies
+WHERE day >= toInteger(timestamp() / 1000 / 86400) - 14
+MERGE (activity:Activity {key:"stackoverflow:" + user.id + "@" + day})
+ON CREATE SET activity.source = "stackoverflow", activity.day = day
+SET activity.replies = replies
+MERGE (user)-[:ACTIVE]->(activity)
+"""
+
+legacy_link_buckets_query = """\
+MATCH (bucket:LinkDay)
+WHERE exists(bucket.key)
+WITH bucket LIMIT {limit}
+DETACH DELETE bucket
+RETURN count(*) AS deleted
+"""
+
+recent_tweets_query = """\
+MATCH (t:Tweet)
+WHERE t.created > (timestamp() / 1000) - {days} * 24 * 60 * 60
+RETURN collect(t.id) AS ids
+"""
+
+recent_questions_query = """\
+MATCH (q:Question)
+WHERE q.created > (timestamp() / 1000) - {days} * 24 * 60 * 60
+RETURN collect(q.id) AS ids
+"""
+
+
+def update_tweet_rollups(tx, tweet_ids, retweeted_ids):
+    if len(retweeted_ids) > 0:
+        tx.run(retweet_counts_query, {"ids": retweeted_ids}).consume()
+    tx.run(link_scores_query, {"ids": tweet_ids + retweeted_ids}).consume()
+    tx.run(twitter_activity_query, {"ids": tweet_ids}).consume()
+
+
+def update_question_rollups(tx, question_ids):
+    tx.run(so_activity_query, {"ids": question_ids}).consume()
+
+
+def rebuild_tweet_rollups(session, days=14, batch_size=1000):
+    # Deployments that predate the rollups have no buckets, and the first link buckets were keyed on a url that
+    # unshortening rewrites; rebuild once from recent tweets, then the checkpoint skips the scan.
+    if load_checkpoint(session, "rollups:twitter", False):
+        return
+    deleted = batch_size
+    while deleted == batch_size:
+        deleted = session.run(legacy_link_buckets_query, {"limit": batch_size}).single()["deleted"]
+
+    tweet_ids = session.run(recent_tweets_query, {"days": days}).single()["ids"]
+    for start in range(0, len(tweet_ids), batch_size):
+        batch = tweet_ids[start:start + batch_size]
+        session.write_transaction(update_tweet_rollups, batch, batch)
+    print("tweet rollups rebuilt from", len(tweet_ids), "tweets")
+    save_checkpoint(session, "rollups:twitter", True)
+
+
+def rebuild_question_rollups(session, days=14, batch_size=1000):
+    if load_checkpoint(session, "rollups:stackoverflow", False):
+        return
+    question_ids = session.run(recent_questions_query, {"days": days}).single()["ids"]
+    for start in range(0, len(question_ids), batch_size):
+        session.write_transaction(update_question_rollups, question_ids[start:start + batch_size])
+    print("question rollups rebuilt from", len(question_ids), "questions")
+    save_checkpoint(session, "rollups:stackoverflow", True)
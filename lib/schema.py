@@ -0,0 +1,87 @@
+import re
+import threading
+
+constraint = "CONSTRAINT"
+index = "INDEX"
+
+schema = {
+    "state": [
+        (constraint, "ImportState", "name"),
+    ],
+    "twitter": [
+        (constraint, "Tweet", "id"),
+        (index, "Tweet", "created"),
+        (index, "User", "screen_name"),
+        (index, "Tag", "name"),
+        (index, "Link", "url"),
+        (index, "Link", "state"),
+        (index, "LinkDay", "day"),
+        (constraint, "Activity", "key"),
+        (index, "Activity", "day"),
+        (constraint, "Host", "name"),
+        (constraint, "Redirect", "url"),
+        (index, "Redirect", "resolvedAt"),
+    ],
+    "github": [
+        (index, "Repository", "id"),
+        (index, "User", "id"),
+    ],
+    "stackoverflow": [
+        (index, "Question", "id"),
+        (index, "Answer", "id"),
+        (index, "User", "id"),
+        (index, "Tag", "name"),
+        (constraint, "Activity", "key"),
+        (index, "Activity", "day"),
+    ],
+    "meetup": [
+        (index, "Event", "id"),
+        (index, "Group", "id"),
+        (index, "Venue", "id"),
+        (index, "User", "id"),
+        (index, "Tag", "name"),
+    ],
+}
+
+indexed_property = re.compile(r":\s*`?(\w+)`?\s*\(\s*`?(\w+)`?\s*\)")
+
+lock = threading.Lock()
+ensured = set()
+
+
+def existing_indexes(session):
+    existing = set()
+    for record in session.run("CALL db.indexes()"):
+        match = indexed_property.search(record["description"])
+        if match is not None:
+            existing.add(match.groups())
+    return existing
+
+
+def missing_schema(session, required):
+    existing = existing_indexes(session)
+    return [(kind, label, key) for kind, label, key in required if (label, key) not in existing]
+
+
+def schema_statement(kind, label, key):
+    if kind == constraint:
+        return "CREATE CONSTRAINT ON (n:{label}) ASSERT n.{key} IS UNIQUE".format(label=label, key=key)
+    return "CREATE INDEX ON :{label}({key})".format(label=label, key=key)
+
+
+def apply_schema(session, required):
+    applied = []
+    for kind, label, key in missing_schema(session, required):
+        statement = schema_statement(kind, label, key)
+        print("Applying", statement)
+        session.run(statement).consume()
+        applied.append(statement)
+    return applied
+
+
+def ensure_schema(session, source):
+    with lock:
+        if source in ensured:
+            return
+        apply_schema(session, schema["state"] + schema[source])
+        ensured.add(source)
@@ -1,7 +1,13 @@
 import time
 
-import requests
-from neo4j.v1 import GraphDatabase, basic_auth
+from lib.checkpoint import load_checkpoint, write_batch
+from lib.digest import ChangeFilter
+import lib.metrics as metrics
+from lib.pipeline import run_pipeline
+from lib.ratelimit import limiter, RateLimitExhausted
+from lib.resources import graph_driver, http_session
+from lib.rollups import update_question_rollups, rebuild_question_rollups
+from lib.schema import ensure_schema
 
 import_query = """\
 WITH {json} as data
@@ -9,7 +15,8 @@ UNWIND data.items as q
 MERGE (question:Question:Content:StackOverflow {id:q.question_id}) 
   ON CREATE SET question.title = q.title, question.url = q.share_link, question.created = q.creation_date                
 SET question.favorites = q.favorite_count, question.updated = q.last_activity_date, question.views = q.view_count,
-    question.upVotes = q.up_vote_count, question.downVotes = q.down_vote_count
+    question.upVotes = q.up_vote_count, question.downVotes = q.down_vote_count, question.digest = q.digest,
+    question.refreshed = timestamp() / 1000
 FOREACH (q_owner IN [o in [q.owner] WHERE o.user_id IS NOT NULL] |
   MERGE (owner:User:StackOverflow {id:q.owner.user_id}) ON CREATE SET owner.name = q.owner.display_name
   MERGE (owner)-[:POSTED]->(question)
@@ -28,37 +35,148 @@ FOREACH (a IN q.answers |
 )
 """
 
+# Questions are due for a refresh once their stats are older than the ttl scaled by their age in days,
+# so this week's questions are refreshed every few hours and old ones only every few weeks.
+stale_questions_query = """\
+MATCH (q:Question:StackOverflow)
+WITH q, (timestamp() / 1000 - q.created) / 86400.0 AS age
+WHERE timestamp() / 1000 - coalesce(q.refreshed, 0) > {ttl} * (1 + age)
+RETURN q.id AS id
+ORDER BY q.created DESC
+LIMIT {limit}
+"""
+
+refreshed_query = """\
+UNWIND {ids} AS id
+MATCH (q:Question {id:id})
+SET q.refreshed = timestamp() / 1000
+"""
+
+question_filter = "!5-i6Zw8Y)4W7vpy91PMYsKM-k9yzEsSC1_Uxlf"
+
+sort_fields = {
+    "activity": "last_activity_date",
+    "creation": "creation_date",
+}
+
+
+def write_questions(tx, json, changes):
+    items = changes.changed(tx, json["items"])
+    if len(items) == 0:
+        return {}
+    counters = tx.run(import_query, {"json": {"items": items}}).consume().counters
+    update_question_rollups(tx, [q["question_id"] for q in items])
+    return counters
+
 
-def import_so(neo4j_url, neo4j_user, neo4j_pass, tag):
-    with GraphDatabase.driver(neo4j_url, auth=basic_auth(neo4j_user, neo4j_pass)) as driver:
+def import_so(neo4j_url, neo4j_user, neo4j_pass, tag, backfill=False):
+    # Hourly runs only pick up questions active since the last run; a backfill walks the full history by creation date.
+    sort = "creation" if backfill else "activity"
+    field = sort_fields[sort]
+
+    with graph_driver(neo4j_url, neo4j_user, neo4j_pass) as driver:
+        with driver.session() as session:
+            ensure_schema(session, "stackoverflow")
+            rebuild_question_rollups(session)
+            watermark = "stackoverflow:{tag}".format(tag=tag) + (":backfill" if backfill else "")
+            since = load_checkpoint(session, watermark, 0)
+            changes = ChangeFilter("Question", key="question_id")
+            print("Processing questions by", sort, "from", since)
+
+            def write(json):
+                nonlocal since
+                since = max([since] + [q[field] for q in json["items"]])
+                with metrics.stage("write") as written:
+                    written.counters = write_batch(session, write_questions, watermark, since, json, changes)
+                    written.records = len(json["items"])
+
+            run_pipeline(fetch_questions(tag, sort, since), transform_questions, write)
+
+
+def refresh_so(neo4j_url, neo4j_user, neo4j_pass, ttl=6 * 60 * 60, limit=3000, batch_size=500):
+    with graph_driver(neo4j_url, neo4j_user, neo4j_pass) as driver:
         with driver.session() as session:
-            page = 1
-            items = 100
-            has_more = True
-
-            while has_more:
-                api_url = "https://api.stackexchange.com/2.2/questions?page={page}&pagesize={items}&order=asc&sort=creation&tagged={tag}&site=stackoverflow&filter=!5-i6Zw8Y)4W7vpy91PMYsKM-k9yzEsSC1_Uxlf".format(
-                    tag=tag, page=page, items=items)
-                #    if maxDate <> None:
-                #        api_url += "&min={maxDate}".format(maxDate=maxDate)
-
-                # Send GET request.
-                response = requests.get(api_url, headers={"accept": "application/json"})
-                print(response.status_code)
-                if response.status_code != 200:
-                    print(response.text)
-                json = response.json()
-                print("has_more", json.get("has_more", False), "quota", json.get("quota_remaining", 0))
-                if json.get("items", None) is not None:
-                    print(len(json["items"]))
-                    result = session.run(import_query, {"json": json})
-                    print(result.consume().counters)
-                    page = page + 1
-
-                has_more = json.get("has_more", False)
-                print("has_more: {more} page {page}".format(page=page, more=has_more))
-                if json.get('quota_remaining', 0) <= 0:
-                    time.sleep(10)
-                if json.get('backoff', None) is not None:
-                    print("backoff", json['backoff'])
-                    time.sleep(json['backoff'] + 5)
+            ensure_schema(session, "stackoverflow")
+            ids = [record["id"] for record in session.run(stale_questions_query, {"ttl": ttl, "limit": limit})]
+            changes = ChangeFilter("Question", key="question_id")
+            print("Refreshing", len(ids), "stale questions")
+
+            def write(batch):
+                with metrics.stage("write") as written:
+                    written.counters = session.write_transaction(refresh_questions, batch, changes)
+                    written.records = len(batch[1]["items"])
+
+            run_pipeline(fetch_questions_by_id(ids, batch_size), lambda batch: batch, write)
+
+
+def refresh_questions(tx, batch, changes):
+    ids, json = batch
+    counters = write_questions(tx, json, changes)
+    tx.run(refreshed_query, {"ids": ids}).consume()
+    return counters
+
+
+def transform_questions(json):
+    if json.get("items", None) is not None:
+        return json
+
+
+def get_questions(api_url):
+    try:
+        limiter("stackoverflow").acquire()
+    except RateLimitExhausted as e:
+        print(e)
+        return None
+
+    with metrics.stage("fetch") as fetched:
+        response = http_session(api_url).get(api_url, headers={"accept": "application/json"})
+        fetched.bytes = len(response.content)
+    if response.status_code != 200:
+        print(response.text)
+    with metrics.stage("decode") as decoded:
+        json = response.json()
+        decoded.records = len(json.get("items", []))
+    limiter("stackoverflow").update(remaining=json.get("quota_remaining"), reset_at=next_utc_midnight(),
+                                    backoff=json.get("backoff"))
+    return json
+
+
+def fetch_questions_by_id(ids, batch_size=500, ids_per_request=100):
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        items = []
+        for offset in range(0, len(batch), ids_per_request):
+            api_url = "https://api.stackexchange.com/2.2/questions/{ids}?pagesize={items}&site=stackoverflow&filter={filter}".format(
+                ids=";".join(str(id) for id in batch[offset:offset + ids_per_request]), items=ids_per_request,
+                filter=question_filter)
+            json = get_questions(api_url)
+            if json is None:
+                return
+            items += json.get("items", [])
+        yield batch, {"items": items}
+
+
+def fetch_questions(tag, sort="activity", since=0):
+    page = 1
+    items = 100
+    has_more = True
+
+    while has_more:
+        api_url = "https://api.stackexchange.com/2.2/questions?page={page}&pagesize={items}&order=asc&sort={sort}&min={since}&tagged={tag}&site=stackoverflow&filter={filter}".format(
+            tag=tag, page=page, items=items, sort=sort, since=since, filter=question_filter)
+
+        json = get_questions(api_url)
+        if json is None:
+            return
+        if json.get("items", None) is not None:
+            page = page + 1
+        yield json
+
+        has_more = json.get("has_more", False)
+        print("has_more: {more} page {page}".format(page=page, more=has_more))
+        if json.get('backoff', None) is not None:
+            print("backoff", json['backoff'])
+
+
+def next_utc_midnight():
+    return (time.time() // 86400 + 1) * 86400
@@ -1,25 +1,28 @@
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timezone
 
-import boto
 import flask
-from ago import human
 from flask import render_template
-from neo4j.v1 import GraphDatabase
+from markupsafe import Markup
+
+from lib.publish import publish, s3_bucket
+from lib.resources import graph_driver
 
 twitter_query = """\
 WITH ((timestamp() / 1000) - (7 * 24 * 60 * 60)) AS oneWeekAgo
-MATCH (l:Link)<--(t:Tweet:Content)
-WHERE not(t:Retweet)
-
-WITH oneWeekAgo, l, t
-ORDER BY l.cleanUrl, toInteger(t.created)
-
-WITH oneWeekAgo, l.cleanUrl AS url, l.title AS title, collect(t) AS tweets
-WHERE toInteger(tweets[0].created) is not null AND tweets[0].created > oneWeekAgo AND NONE(rogue in ["abizy.com", "twitter.com", "corneey.com"] WHERE url contains rogue)
-RETURN url, title,
-       REDUCE(acc = 0, tweet IN tweets | acc + tweet.favorites + size((tweet)<-[:RETWEETED]-())) AS score,
-       tweets[0].created * 1000 AS dateCreated,
-       apoc.coll.toSet([ tweet IN tweets | head([ (tweet)<-[:POSTED]-(user) | user.screen_name]) ]) AS users
+MATCH (bucket:LinkDay)
+WHERE bucket.day >= toInteger(oneWeekAgo / 86400)
+MATCH (l:Link)-[:SCORED]->(bucket)
+WHERE l.firstTweeted > oneWeekAgo
+
+WITH l.cleanUrl AS url, collect(DISTINCT l) AS links, collect(bucket) AS buckets
+WHERE url IS NOT NULL AND NONE(rogue in ["abizy.com", "twitter.com", "corneey.com"] WHERE url contains rogue)
+RETURN url, links[0].title AS title,
+       REDUCE(acc = 0, bucket IN buckets | acc + bucket.score) AS score,
+       REDUCE(first = null, l IN links | CASE WHEN first IS NULL OR l.firstTweeted < first THEN l.firstTweeted ELSE first END) * 1000 AS dateCreated,
+       apoc.coll.toSet(REDUCE(acc = [], bucket IN buckets | acc + bucket.users)) AS users
 ORDER BY score DESC
 """
 
@@ -57,45 +60,56 @@ RETURN user.name, user.avatarUrl, count, [repo in repos | repo { .title, .full_n
 """
 
 twitter_active_query = """\
-MATCH (n:Tweet)
-WHERE EXISTS(n.created) AND n.created > ((timestamp() / 1000) - 7 * 60 * 60 * 24 )
-WITH n
-MATCH (n)<-[:POSTED]-(user) WHERE NOT (user.screen_name IN ["neo4j", "neo4j-contrib"])
-
-WITH user, COUNT(*) AS count
-ORDER BY count desc
-
-WITH user, count
-OPTIONAL MATCH (user)-[:POSTED]->(n:Tweet)
-WHERE EXISTS(n.created)
-AND ((timestamp() / 1000) - 7 * 60 * 60 * 24 ) > n.created > ((timestamp() / 1000) - 14 * 60 * 60 * 24 )
-RETURN user.screen_name AS user, user.profile_image_url AS profile_image, count, count(n) AS lastWeekCount
+WITH toInteger(timestamp() / 1000 / 86400) AS today
+MATCH (activity:Activity)
+WHERE activity.day > today - 14 AND activity.source = "twitter"
+MATCH (user)-[:ACTIVE]->(activity)
+WHERE NOT (user.screen_name IN ["neo4j", "neo4j-contrib"])
+
+WITH user,
+     sum(CASE WHEN activity.day > today - 7 THEN activity.posts ELSE 0 END) AS count,
+     sum(CASE WHEN activity.day <= today - 7 THEN activity.posts ELSE 0 END) AS lastWeekCount
+WHERE count > 0
+RETURN user.screen_name AS user, user.profile_image_url AS profile_image, count, lastWeekCount
 ORDER BY count desc
 """
 
 so_active_query = """\
-WITH ((timestamp() / 1000) - (7 * 24 * 60 * 60)) AS oneWeekAgo,
-     ((timestamp() / 1000) - (14* 24 * 60 * 60)) AS twoWeeksAgo
-MATCH (question:Question:Content:StackOverflow)<--(:Answer)<-[:POSTED]-(user)
-WHERE question.created > oneWeekAgo
-
-WITH user, count(*) AS replies, oneWeekAgo, twoWeeksAgo
-ORDER BY replies DESC
-OPTIONAL MATCH (user)-[:POSTED]->(:Answer)-->(question:Question)
-WHERE oneWeekAgo > question.created > twoWeeksAgo
-RETURN user, replies, COUNT(question) AS lastWeekReplies
+WITH toInteger(timestamp() / 1000 / 86400) AS today
+MATCH (activity:Activity)
+WHERE activity.day > today - 14 AND activity.source = "stackoverflow"
+MATCH (user)-[:ACTIVE]->(activity)
+
+WITH user,
+     sum(CASE WHEN activity.day > today - 7 THEN activity.replies ELSE 0 END) AS replies,
+     sum(CASE WHEN activity.day <= today - 7 THEN activity.replies ELSE 0 END) AS lastWeekReplies
+WHERE replies > 0
+RETURN user, replies, lastWeekReplies
 ORDER BY replies DESC
 """
 
-app = flask.Flask('my app')
+time_now_placeholder = "__time_now__"
+
+app = None
+
+
+def get_app():
+    global app
+    if app is None:
+        app = flask.Flask('my app')
+        app.add_template_filter(humanise_filter, 'humanise')
+        app.add_template_filter(shorten_filter, 'shorten')
+    return app
 
 
-@app.template_filter('humanise')
 def humanise_filter(value):
-    return human(datetime.fromtimestamp(value / 1000), precision=1)
+    # The page shows the absolute time and the browser rewrites it as "5 hours ago", so the rendered page and its
+    # digest stay the same from run to run until the data changes.
+    moment = datetime.fromtimestamp(value / 1000, timezone.utc)
+    return Markup('<time class="ago" datetime="{iso}">{text}</time>').format(
+        iso=moment.isoformat(), text=moment.strftime("%Y-%m-%d %H:%M UTC"))
 
 
-@app.template_filter("shorten")
 def shorten_filter(value):
     if not value:
         return value
@@ -103,36 +117,75 @@ def shorten_filter(value):
         return (value[:75] + '..') if len(value) > 75 else value
 
 
-def generate(url, user, password, title, short_name, logo_src):
-
-    with GraphDatabase.driver("bolt://{url}:7687".format(url=url), auth=(user, password)) as driver:
-        with driver.session() as session:
-            github_records = session.read_transaction(lambda tx: list(tx.run(github_query)))
-            twitter_records = session.read_transaction(lambda tx: list(tx.run(twitter_query)))
-            meetup_records = session.read_transaction(lambda tx: list(tx.run(meetup_query)))
-            so_records = session.read_transaction(lambda tx: list(tx.run(so_query)))
-            github_active_members = session.read_transaction(lambda tx: list(tx.run(github_active_query)))
-            twitter_active_members = session.read_transaction(lambda tx: list(tx.run(twitter_active_query)))
-            so_active_members = session.read_transaction(lambda tx: list(tx.run(so_active_query)))
-
-    with app.app_context():
+summary_queries = [
+    ("github_records", github_query),
+    ("twitter_records", twitter_query),
+    ("meetup_records", meetup_query),
+    ("so_records", so_query),
+    ("github_active_members", github_active_query),
+    ("twitter_active_members", twitter_active_query),
+    ("so_active_members", so_active_query),
+]
+
+
+def read_query(driver, query):
+    with driver.session() as session:
+        return session.read_transaction(lambda tx: list(tx.run(query)))
+
+
+def run_summary_queries(driver, concurrency, query_timeout):
+    # The deadline runs from submission, so sections queued behind hung reads time out too.
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    deadline = time.time() + query_timeout
+    pending = {executor.submit(read_query, driver, query): name for name, query in summary_queries}
+
+    sections = {}
+    unavailable = []
+    while len(pending) > 0:
+        done, _ = wait(pending, timeout=max(0, min(0.5, deadline - time.time())), return_when=FIRST_COMPLETED)
+        for future in done:
+            name = pending.pop(future)
+            try:
+                sections[name] = future.result()
+            except Exception as e:
+                print("Section unavailable:", name, e)
+                unavailable.append(name)
+
+        if time.time() >= deadline:
+            for future, name in pending.items():
+                future.cancel()
+                print("Section timed out:", name)
+                unavailable.append(name)
+            pending = {}
+
+    # Reads that are already running cannot be interrupted; their threads and sessions are released when the
+    # server answers or the connection drops.
+    executor.shutdown(wait=False)
+    for name in unavailable:
+        sections[name] = []
+    return sections, unavailable
+
+
+def generate(url, user, password, title, short_name, logo_src, concurrency=4, query_timeout=60, bucket=None):
+
+    with graph_driver("bolt://{url}:7687".format(url=url), user, password) as driver:
+        sections, unavailable = run_summary_queries(driver, concurrency, query_timeout)
+
+    body, digest = render(sections, unavailable, title, logo_src)
+    bucket = bucket or s3_bucket(short_name)
+    return publish(bucket, "{summary}.html".format(summary=short_name), body, digest)
+
+
+def render(sections, unavailable, title, logo_src):
+    with get_app().app_context():
+        # Render with a placeholder timestamp so the digest only changes when the content does.
         rendered = render_template('index.html',
-                                   github_records=github_records,
-                                   twitter_records=twitter_records,
-                                   meetup_records=meetup_records,
-                                   so_records=so_records,
-                                   github_active_members=github_active_members,
-                                   twitter_active_members=twitter_active_members,
-                                   so_active_members=so_active_members,
+                                   unavailable=unavailable,
                                    title=title,
                                    logo_src=logo_src,
-                                   time_now=str(datetime.now(timezone.utc)))
-
-        local_file_name = "/tmp/{file_name}.html".format(file_name=short_name)
-        with open(local_file_name, "wb") as file:
-            file.write(rendered.encode('utf-8'))
+                                   time_now=time_now_placeholder,
+                                   **sections)
 
-        s3_connection = boto.connect_s3()
-        bucket = s3_connection.get_bucket(short_name)
-        key = boto.s3.key.Key(bucket, "{summary}.html".format(summary=short_name))
-        key.set_contents_from_filename(local_file_name)
+    digest = hashlib.sha256(rendered.encode('utf-8')).hexdigest()
+    body = rendered.replace(time_now_placeholder, str(datetime.now(timezone.utc))).encode('utf-8')
+    return body, digest
@@ -0,0 +1,105 @@
+import codecs
+import re
+from html.parser import HTMLParser
+
+import requests
+
+html_content_types = ("text/html", "application/xhtml+xml")
+header_charset = re.compile(r"""charset=["']?([a-zA-Z0-9_\-]+)""", re.IGNORECASE)
+meta_charset = re.compile(rb"""<meta[^>]+charset=["']?([a-zA-Z0-9_\-]+)""", re.IGNORECASE)
+
+
+class HeadParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = None
+        self.og_title = None
+        self.canonical = None
+        self.in_title = False
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "title" and self.title is None:
+            self.in_title = True
+            self.title = ""
+        elif tag == "meta" and attrs.get("property") == "og:title" and self.og_title is None:
+            self.og_title = attrs.get("content")
+        elif tag == "link" and "canonical" in (attrs.get("rel") or "").lower().split() and self.canonical is None:
+            self.canonical = attrs.get("href")
+        elif tag == "body":
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self.in_title = False
+        elif tag == "head":
+            self.done = True
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title += data
+
+    def complete(self):
+        found = self.title is not None and not self.in_title and self.og_title is not None and self.canonical is not None
+        return self.done or found
+
+    def result(self):
+        title = " ".join(self.title.split()) if self.title else None
+        return {"title": title, "og_title": self.og_title, "canonical": self.canonical}
+
+
+def is_html(content_type):
+    return content_type is None or content_type.split(";")[0].strip().lower() in html_content_types
+
+
+def charset_of(content_type, sniffed):
+    candidates = []
+    match = header_charset.search(content_type or "")
+    if match is not None:
+        candidates.append(match.group(1))
+    match = meta_charset.search(sniffed)
+    if match is not None:
+        candidates.append(match.group(1).decode("ascii"))
+
+    for candidate in candidates:
+        try:
+            return codecs.lookup(candidate).name
+        except LookupError:
+            pass
+    return "utf-8"
+
+
+def extract_head(chunks, content_type=None, max_bytes=256 * 1024, sniff_bytes=1024):
+    parser = HeadParser()
+    decoder = None
+    pending = b""
+    read = 0
+    for chunk in chunks:
+        chunk = chunk[:max_bytes - read]
+        read += len(chunk)
+        if decoder is None:
+            pending += chunk
+            if len(pending) < sniff_bytes and read < max_bytes:
+                continue
+            decoder = codecs.getincrementaldecoder(charset_of(content_type, pending))(errors="replace")
+            chunk = pending
+        parser.feed(decoder.decode(chunk))
+        if parser.complete() or read >= max_bytes:
+            break
+    else:
+        if decoder is None:
+            decoder = codecs.getincrementaldecoder(charset_of(content_type, pending))(errors="replace")
+            parser.feed(decoder.decode(pending, final=True))
+    return parser.result()
+
+
+def fetch_head(url, session=requests, timeout=5.0, max_bytes=256 * 1024, chunk_size=8192):
+    response = session.get(url, headers={'User-agent': 'Mozilla/5.0'}, timeout=timeout, stream=True)
+    try:
+        content_type = response.headers.get("Content-Type")
+        if not is_html(content_type):
+            return None
+        return extract_head(response.iter_content(chunk_size=chunk_size), content_type, max_bytes)
+    finally:
+        response.close()
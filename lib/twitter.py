@@ -1,78 +1,36 @@
-import http.client
-import socket
-from urllib.parse import urlparse
+import time
+from collections import Counter
 
-from neo4j.v1 import GraphDatabase, basic_auth
-import requests
-from bs4 import BeautifulSoup
+from lib.checkpoint import load_checkpoint, save_checkpoint, write_batch
+from lib.pipeline import run_pipeline, interleave
+from lib.resources import graph_driver, http_session
+from lib.schema import ensure_schema
+from lib.ratelimit import limiter, RateLimitExhausted
+from lib.rollups import update_tweet_rollups, rebuild_tweet_rollups
+from lib.urls import canonical_url
+import lib.metrics as metrics
 
-import time
 import urllib
 import urllib.parse
 
-from urllib.parse import urlencode, urlparse, urlunparse, parse_qs
-
 # from neo4j.util import Watcher
 # watcher = Watcher("neo4j.bolt")
 # watcher.watch()
 
-find_short_links_query = """\
-MATCH (link:Link) 
-WHERE exists(link.short) 
-RETURN id(link) as id, link.url as url LIMIT 
-{limit}
+tag_nodes_query = """\
+UNWIND {rows} AS name
+MERGE (tag:Tag {name:name}) SET tag:Twitter
 """
 
-unshorten_query = """\
-UNWIND {data} AS row 
-MATCH (link) 
-WHERE id(link) = row.id 
-SET link.url = row.url 
-REMOVE link.short
+link_nodes_query = """\
+UNWIND {rows} AS l
+MERGE (url:Link {url:l.url})
+ON CREATE SET url.short = l.short, url.cleanUrl = l.url, url.state = "pending"
+SET url:Twitter
 """
 
-
-def unshorten_links(neo4j_url, neo4j_user, neo4j_pass):
-    with GraphDatabase.driver(neo4j_url, auth=basic_auth(neo4j_user, neo4j_pass)) as driver:
-        with driver.session() as session:
-            result = session.run(find_short_links_query, {"limit": 1000})
-            update = []
-            rows = 0
-            for record in result:
-                try:
-                    resolved = unshorten_url(record["url"])
-                    print("original", record["url"], "resolved", resolved)
-                    rows = rows + 1
-                    if resolved != record["url"]:
-                        update += [{"id": record["id"], "url": resolved}]
-                except AttributeError:
-                    print("Failed to resolve {0}. Ignoring for now".format(record["url"]))
-                except socket.gaierror:
-                    print("Failed to resolve {0}. Ignoring for now".format(record["url"]))
-                except socket.error:
-                    print("Failed to connect to {0}. Ignoring for now".format(record["url"]))
-
-            print("urls", len(update), "records", rows)
-            result = session.run(unshorten_query, {"data": update})
-            print(result.consume().counters)
-
-import_query = """\
-UNWIND {tweets} AS t
-
-WITH t
-ORDER BY t.id
-
-WITH t,
-     t.entities AS e,
-     t.user AS u,
-     t.retweeted_status AS retweet
-
-MERGE (tweet:Tweet:Twitter {id:t.id})
-SET tweet:Content, tweet.text = t.text,
-    tweet.created_at = t.created_at,
-    tweet.created = apoc.date.parse(t.created_at,'s','E MMM dd HH:mm:ss Z yyyy'),
-    tweet.favorites = t.favorite_count
-
+user_nodes_query = """\
+UNWIND {rows} AS u
 MERGE (user:User {screen_name:u.screen_name})
 SET user.name = u.name, user.id = u.id,
     user.location = u.location,
@@ -81,231 +39,355 @@ SET user.name = u.name, user.id = u.id,
     user.statuses = u.statuses_count,
     user.profile_image_url = u.profile_image_url,
     user:Twitter
+"""
+
+mentioned_nodes_query = """\
+UNWIND {rows} AS m
+MERGE (mentioned:User {screen_name:m.screen_name})
+ON CREATE SET mentioned.name = m.name, mentioned.id = m.id
+SET mentioned:Twitter
+"""
+
+tweet_nodes_query = """\
+UNWIND {rows} AS t
+MERGE (tweet:Tweet:Twitter {id:t.id})
+SET tweet:Content, tweet.text = t.text,
+    tweet.created_at = t.created_at,
+    tweet.created = apoc.date.parse(t.created_at,'s','E MMM dd HH:mm:ss Z yyyy'),
+    tweet.favorites = t.favorites
+FOREACH (_ IN CASE WHEN t.reply THEN [1] ELSE [] END | SET tweet:Reply)
+FOREACH (_ IN CASE WHEN t.retweet THEN [1] ELSE [] END | SET tweet:Retweet)
+"""
 
+referenced_nodes_query = """\
+UNWIND {rows} AS id
+MERGE (:Tweet:Twitter {id:id})
+"""
+
+posted_query = """\
+UNWIND {rows} AS r
+MATCH (user:User {screen_name:r.user}), (tweet:Tweet {id:r.tweet})
 MERGE (user)-[:POSTED]->(tweet)
+"""
 
-FOREACH (h IN e.hashtags |
-  MERGE (tag:Tag {name:LOWER(h.text)}) SET tag:Twitter
-  MERGE (tag)<-[:TAGGED]-(tweet)
-)
-
-FOREACH (u IN e.urls |
-  MERGE (url:Link {url:u.expanded_url})
-  ON CREATE SET url.short = case when length(u.expanded_url) < 25 then true else null end
-  SET url:Twitter
-  MERGE (tweet)-[:LINKED]->(url)
-)
-
-FOREACH (m IN e.user_mentions |
-  MERGE (mentioned:User {screen_name:m.screen_name})
-  ON CREATE SET mentioned.name = m.name, mentioned.id = m.id
-  SET mentioned:Twitter
-  MERGE (tweet)-[:MENTIONED]->(mentioned)
-)
-
-FOREACH (r IN [r IN [t.in_reply_to_status_id] WHERE r IS NOT NULL] |
-  MERGE (reply_tweet:Tweet:Twitter {id:r})
-  MERGE (tweet)-[:REPLIED_TO]->(reply_tweet)
-  SET tweet:Reply
-)
-
-FOREACH (retweet_id IN [x IN [retweet.id] WHERE x IS NOT NULL] |
-    MERGE (retweet_tweet:Tweet:Twitter {id:retweet_id})
-    MERGE (tweet)-[:RETWEETED]->(retweet_tweet)
-    SET tweet:Retweet
-)
+tagged_query = """\
+UNWIND {rows} AS r
+MATCH (tweet:Tweet {id:r.tweet}), (tag:Tag {name:r.tag})
+MERGE (tag)<-[:TAGGED]-(tweet)
 """
 
+linked_query = """\
+UNWIND {rows} AS r
+MATCH (tweet:Tweet {id:r.tweet}), (url:Link {url:r.url})
+MERGE (tweet)-[:LINKED]->(url)
+"""
+
+mentioned_query = """\
+UNWIND {rows} AS r
+MATCH (tweet:Tweet {id:r.tweet}), (mentioned:User {screen_name:r.user})
+MERGE (tweet)-[:MENTIONED]->(mentioned)
+"""
 
-def import_links(neo4j_url, neo4j_user, neo4j_pass, bearer_token, search):
+replied_query = """\
+UNWIND {rows} AS r
+MATCH (tweet:Tweet {id:r.tweet}), (reply_tweet:Tweet {id:r.target})
+MERGE (tweet)-[:REPLIED_TO]->(reply_tweet)
+"""
+
+retweeted_query = """\
+UNWIND {rows} AS r
+MATCH (tweet:Tweet {id:r.tweet}), (retweet_tweet:Tweet {id:r.target})
+MERGE (tweet)-[:RETWEETED]->(retweet_tweet)
+"""
+
+# Nodes before relationships, each set sorted by key, so concurrent batches take locks in the same order.
+tweet_plan_queries = [
+    ("tags", tag_nodes_query),
+    ("links", link_nodes_query),
+    ("users", user_nodes_query),
+    ("mentions", mentioned_nodes_query),
+    ("tweets", tweet_nodes_query),
+    ("referenced", referenced_nodes_query),
+    ("posted", posted_query),
+    ("tagged", tagged_query),
+    ("linked", linked_query),
+    ("mentioned", mentioned_query),
+    ("replied", replied_query),
+    ("retweeted", retweeted_query),
+]
+
+
+user_fields = ["screen_name", "name", "id", "location", "followers_count", "friends_count", "statuses_count",
+               "profile_image_url"]
+
+
+def plan_tweets(statuses):
+    tweets = {}
+    users = {}
+    mentions = {}
+    tags = set()
+    links = {}
+    referenced = set()
+    posted, tagged, linked, mentioned, replied, retweeted = set(), set(), set(), set(), set(), set()
+
+    for t in sorted(statuses, key=lambda t: t["id"]):
+        e = t.get("entities", {})
+        u = t["user"]
+        reply_id = t.get("in_reply_to_status_id")
+        retweet = t.get("retweeted_status")
+
+        tweets[t["id"]] = {"id": t["id"], "text": t.get("text"), "created_at": t.get("created_at"),
+                           "favorites": t.get("favorite_count"),
+                           "reply": reply_id is not None, "retweet": retweet is not None}
+        users[u["screen_name"]] = {key: u.get(key) for key in user_fields}
+        posted.add((u["screen_name"], t["id"]))
+
+        for h in e.get("hashtags", []):
+            tags.add(h["text"].lower())
+            tagged.add((t["id"], h["text"].lower()))
+
+        for url in e.get("urls", []):
+            expanded = canonical_url(url.get("expanded_url"))
+            if expanded is not None:
+                links[expanded] = {"url": expanded, "short": True if len(expanded) < 25 else None}
+                linked.add((t["id"], expanded))
+
+        for m in e.get("user_mentions", []):
+            mentions.setdefault(m["screen_name"], {"screen_name": m["screen_name"], "name": m.get("name"),
+                                                   "id": m.get("id")})
+            mentioned.add((t["id"], m["screen_name"]))
+
+        if reply_id is not None:
+            referenced.add(reply_id)
+            replied.add((t["id"], reply_id))
+
+        if retweet is not None and retweet.get("id") is not None:
+            referenced.add(retweet["id"])
+            retweeted.add((t["id"], retweet["id"]))
+
+    return {
+        "tags": sorted(tags),
+        "links": [links[url] for url in sorted(links)],
+        "users": [users[name] for name in sorted(users)],
+        "mentions": [mentions[name] for name in sorted(mentions) if name not in users],
+        "tweets": [tweets[id] for id in sorted(tweets)],
+        "referenced": sorted(referenced - set(tweets)),
+        "posted": [{"user": user, "tweet": tweet} for user, tweet in sorted(posted, key=lambda r: r[1])],
+        "tagged": [{"tweet": tweet, "tag": tag} for tweet, tag in sorted(tagged)],
+        "linked": [{"tweet": tweet, "url": url} for tweet, url in sorted(linked)],
+        "mentioned": [{"tweet": tweet, "user": user} for tweet, user in sorted(mentioned)],
+        "replied": [{"tweet": tweet, "target": target} for tweet, target in sorted(replied)],
+        "retweeted": [{"tweet": tweet, "target": target} for tweet, target in sorted(retweeted)],
+    }
+
+
+def import_links(neo4j_url, neo4j_user, neo4j_pass, bearer_token, search, backfill=False, days=7, ranges=8,
+                 workers=4):
     if len(bearer_token) == 0:
         raise Exception("No Twitter Bearer token configured")
 
-    with GraphDatabase.driver(neo4j_url, auth=basic_auth(neo4j_user, neo4j_pass)) as driver:
+    with graph_driver(neo4j_url, neo4j_user, neo4j_pass) as driver:
         with driver.session() as session:
-
-            # Add uniqueness constraints.
-            # session.run("CREATE CONSTRAINT ON (t:Tweet) ASSERT t.id IS UNIQUE;")
-            # session.run("CREATE CONSTRAINT ON (u:User) ASSERT u.screen_name IS UNIQUE;")
-            # session.run("CREATE INDEX ON :Tag(name);")
-            # session.run("CREATE INDEX ON :Link(url);")
-            # session.run("CREATE INDEX ON :Tweet(created);")
-
+            ensure_schema(session, "twitter")
+            rebuild_tweet_rollups(session)
             q = urllib.parse.quote(search, safe='')
+            if backfill:
+                backfill_links(session, q, bearer_token, search, days, ranges, workers)
+                return
+
             max_pages = 100
-            # False for retrieving history, True for catchup forward
-            catch_up = True
             count = 100
             result_type = "recent"
             lang = "en"
 
-            since_id = -1
-            max_id = -1
-            page = 1
-
-            has_more = True
-            while has_more and page <= max_pages:
-                if catch_up:
-                    result = session.run("MATCH (t:Tweet:Content) RETURN max(t.id) as sinceId")
-                    for record in result:
-                        print(record)
-                        if record["sinceId"] is not None:
-                            since_id = record["sinceId"]
-
-                api_url = "https://api.twitter.com/1.1/search/tweets.json?q=%s&count=%s&result_type=%s&lang=%s" % (
-                    q, count, result_type, lang)
-                if since_id != -1:
-                    api_url += "&since_id=%s" % (since_id)
-                if max_id != -1:
-                    api_url += "&max_id=%s" % (max_id)
-
-                response = requests.get(api_url,
-                                        headers={"accept": "application/json",
-                                                 "Authorization": "Bearer " + bearer_token})
-                if response.status_code != 200:
-                    raise (Exception(response.status_code, response.text))
-
-                json = response.json()
-                meta = json["search_metadata"]
-
-                if not catch_up and meta.get('next_results', None) is not None:
-                    max_id = meta["next_results"].split("=")[1][0:-2]
-                tweets = json.get("statuses", [])
-
-                if len(tweets) > 0:
-                    result = session.run(import_query, {"tweets": tweets})
-                    print(result.consume().counters)
-                    page = page + 1
-
-                has_more = len(tweets) == count
-
-                print("catch_up", catch_up, "more", has_more, "page", page, "max_id", max_id,
-                      "since_id", since_id, "tweets", len(tweets))
-                time.sleep(1)
-
-                if json.get('backoff', None) is not None:
-                    print("backoff", json['backoff'])
-                    time.sleep(json['backoff'] + 5)
-
-unhydrated_query = """\
-MATCH (link:Link) 
-WHERE not exists(link.title) 
-RETURN id(link) as id, link.url as url 
-ORDER BY ID(link) DESC 
-LIMIT {limit}
-"""
-
-
-def hydrate_links(neo4j_url, neo4j_user, neo4j_pass):
-    with GraphDatabase.driver(neo4j_url, auth=basic_auth(neo4j_user, neo4j_pass)) as driver:
-        with driver.session() as session:
-            result = session.run(unhydrated_query, {"limit": 100})
-
-            rows = 0
-            for record in result:
-                try:
-                    print("Processing {0}".format(record["url"]))
-                    title = hydrate_url(record["url"])
-                    rows += 1
-                    update_graph(session, {"id": record["id"], "title": title})
-                except AttributeError:
-                    print("Failed to resolve {0}. Ignoring for now".format(record["url"]))
-                    update_graph(session, {"id": record["id"], "title": "N/A"})
-                except socket.gaierror:
-                    print("Failed to resolve {0}. Ignoring for now".format(record["url"]))
-                    update_graph(session, {"id": record["id"], "title": "N/A"})
-                except socket.error:
-                    print("Failed to connect to {0}. Ignoring for now".format(record["url"]))
-                    update_graph(session, {"id": record["id"], "title": "N/A"})
-
-            print("records", rows)
-
-
-def update_graph(session, update):
-    result = session.run(
-        "WITH {data} AS row MATCH (link) WHERE id(link) = row.id SET link.title = row.title",
-        {"data": update})
-    print(result.consume().counters)
-
-
-def hydrate_url(url):
-    user_agent = {'User-agent': 'Mozilla/5.0'}
-    potential_title = []
-    try:
-        if url:
-            r = requests.get(url, headers=user_agent, timeout=5.0)
-            response = r.text
-            page = BeautifulSoup(response, "html.parser")
-            potential_title = page.find_all("title")
-    except requests.exceptions.ConnectionError:
-        print("Failed to connect: ", url)
-    except requests.exceptions.ReadTimeout:
-        print("Read timed out: ", url)
-
-    if len(potential_title) == 0:
-        print("Skipping: ", url)
-        return "N/A"
+            watermark = "twitter:{search}".format(search=search)
+            since_id = load_checkpoint(session, watermark, -1)
+            if since_id == -1:
+                result = session.run("MATCH (t:Tweet:Content) RETURN max(t.id) as sinceId")
+                for record in result:
+                    print(record)
+                    if record["sinceId"] is not None:
+                        since_id = record["sinceId"]
+
+            def write(tweets):
+                nonlocal since_id
+                since_id = max([since_id] + [tweet["id"] for tweet in tweets])
+                with metrics.stage("write") as written:
+                    written.counters = write_batch(session, write_tweets, watermark, since_id, tweets)
+                    written.records = len(tweets)
+
+            pages = fetch_tweets(q, bearer_token, since_id, max_pages, count, result_type, lang)
+            run_pipeline(pages, lambda tweets: tweets if len(tweets) > 0 else None, write)
+
+
+twitter_epoch_ms = 1288834974657
+
+
+def snowflake_id(timestamp):
+    # Tweet ids start with the milliseconds since the Twitter epoch, so a time maps to the lowest id minted then.
+    return int(timestamp * 1000 - twitter_epoch_ms) << 22
+
+
+def backfill_links(session, q, bearer_token, search, days, ranges, workers, max_pages=50, count=100,
+                   result_type="recent", lang="en"):
+    # The id space is split into ranges once and the split is stored, so every invocation pages the same ranges.
+    plan = "twitter:{search}:backfill".format(search=search)
+    bounds = load_checkpoint(session, plan, None)
+    if bounds is None:
+        now = time.time()
+        low, high = snowflake_id(now - days * 24 * 60 * 60), snowflake_id(now)
+        bounds = [low + (high - low) * i // ranges for i in range(ranges + 1)]
+        save_checkpoint(session, plan, bounds)
+
+    # Each range is paged from its top down; its checkpoint is the next max_id, and drops below the range once done.
+    sources = []
+    unfinished = set()
+    failed = []
+    for low, high in zip(bounds, bounds[1:]):
+        cursor = load_checkpoint(session, range_checkpoint(search, low), high - 1)
+        if cursor >= low:
+            unfinished.add(low)
+            sources.append(lambda low=low, cursor=cursor: backfill_range(q, bearer_token, low, cursor, max_pages, count,
+                                                                         result_type, lang, failed))
+    print("Backfilling", len(sources), "of", len(bounds) - 1, "ranges")
+
+    def write(page):
+        low, cursor, tweets = page
+        if cursor < low:
+            unfinished.discard(low)
+        if len(tweets) == 0:
+            save_checkpoint(session, range_checkpoint(search, low), cursor)
+            return
+        with metrics.stage("write") as written:
+            written.counters = write_batch(session, write_tweets, range_checkpoint(search, low), cursor, tweets)
+            written.records = len(tweets)
+
+    run_pipeline(interleave(sources, workers), lambda page: page, write)
+
+    if len(failed) > 0:
+        raise Exception("Backfill failed for {0} of {1} ranges: {2}".format(
+            len(failed), len(bounds) - 1, ", ".join("{0}: {1!r}".format(low, e) for low, e in failed)))
+    if len(unfinished) == 0:
+        # The whole window is done, so the next backfill plans a fresh one ending at that time.
+        for low in bounds[:-1]:
+            save_checkpoint(session, range_checkpoint(search, low), None)
+        save_checkpoint(session, plan, None)
+        print("Backfill complete")
     else:
-        return potential_title[0].text
-
+        print("Backfill has", len(unfinished), "ranges left")
 
-def unshorten_url(url):
-    if url is None or len(url) < 11:
-        return url
-    parsed = urlparse(url)
-    h = http.client.HTTPConnection(parsed.netloc)
-    h.request('HEAD', parsed.path)
-    response = h.getresponse()
-    if response.status // 100 == 3 and response.getheader('Location'):
-        loc = str(response.getheader('Location'))
 
-        if loc != url and len(loc) <= 22:
-            return unshorten_url(loc)
-        else:
-            return loc
-    else:
-        return url
-
-not_cleaned_links_query = """\
-MATCH (l:Link) 
-WHERE NOT(EXISTS(l.short)) AND NOT(EXISTS(l.cleanUrl))
-RETURN l, ID(l) AS internalId
-"""
-
-update_links_query = """\
-UNWIND {updates} AS update
-MATCH (l:Link) WHERE ID(l) = update.id
-SET l.cleanUrl = update.clean
-"""
-
-
-def clean_links(neo4j_url, neo4j_user, neo4j_pass):
-    with GraphDatabase.driver(neo4j_url, auth=basic_auth(neo4j_user, neo4j_pass)) as driver:
-        with driver.session() as session:
-            result = session.run(not_cleaned_links_query)
+def backfill_range(q, bearer_token, low, cursor, max_pages, count, result_type, lang, failed):
+    try:
+        yield from fetch_range(q, bearer_token, low, cursor, max_pages, count, result_type, lang)
+    except Exception as e:
+        failed.append((low, e))
+        raise
 
-            updates = []
-            for row in result:
-                uri = row["l"]["url"]
-                if uri:
-                    uri = uri.encode('utf-8')
-                    print("URL to clean:", uri)
-                    updates.append({"id": row["internalId"], "clean": clean_uri(uri)})
 
-            print("Updates to apply", updates)
+def range_checkpoint(search, low):
+    return "twitter:{search}:backfill:{low}".format(search=search, low=low)
 
-            update_result = session.run(update_links_query, {"updates": updates})
 
-            print(update_result)
+def fetch_range(q, bearer_token, low, cursor, max_pages, count, result_type, lang):
+    for _ in range(max_pages):
+        json = search_tweets(q, bearer_token, low - 1, cursor, count, result_type, lang)
+        if json is None:
+            return
+        tweets = json.get("statuses", [])
+        next_max_id = next_results_max_id(json["search_metadata"])
+        if len(tweets) == 0 or next_max_id is None:
+            cursor = low - 1
+        else:
+            cursor = min(next_max_id, min(tweet["id"] for tweet in tweets) - 1)
+        yield low, cursor, tweets
+        if cursor < low:
+            return
 
 
-def clean_uri(url):
-    u = urlparse(url)
-    query = parse_qs(u.query.decode("utf-8"))
+def next_results_max_id(meta):
+    next_results = meta.get("next_results")
+    if not next_results:
+        return None
+    max_id = urllib.parse.parse_qs(next_results.lstrip("?")).get("max_id")
+    return int(max_id[0]) if max_id else None
 
-    for param in ["utm_content", "utm_source", "utm_medium", "utm_campaign", "utm_term"]:
-        query.pop(param, None)
 
-    u = u._replace(query=bytes(urlencode(query, True), "utf-8"))
+def search_tweets(q, bearer_token, since_id, max_id, count, result_type, lang):
+    api_url = "https://api.twitter.com/1.1/search/tweets.json?q=%s&count=%s&result_type=%s&lang=%s" % (
+        q, count, result_type, lang)
+    if since_id != -1:
+        api_url += "&since_id=%s" % (since_id)
+    if max_id != -1:
+        api_url += "&max_id=%s" % (max_id)
 
-    return urlunparse(u).decode("utf-8")
\ No newline at end of file
+    try:
+        limiter("twitter").acquire()
+    except RateLimitExhausted as e:
+        print(e)
+        return None
+
+    with metrics.stage("fetch") as fetched:
+        response = http_session(api_url).get(api_url,
+                                             headers={"accept": "application/json",
+                                                      "Authorization": "Bearer " + bearer_token})
+        fetched.bytes = len(response.content)
+    if response.status_code != 200:
+        raise (Exception(response.status_code, response.text))
+
+    with metrics.stage("decode") as decoded:
+        json = response.json()
+        decoded.records = len(json.get("statuses", []))
+    remaining = response.headers.get("x-rate-limit-remaining")
+    reset_at = response.headers.get("x-rate-limit-reset")
+    limiter("twitter").update(remaining=int(remaining) if remaining else None,
+                              reset_at=int(reset_at) if reset_at else None,
+                              backoff=json.get("backoff"))
+    if json.get('backoff', None) is not None:
+        print("backoff", json['backoff'])
+    return json
+
+
+def fetch_tweets(q, bearer_token, since_id, max_pages, count, result_type, lang):
+    page = 1
+    has_more = True
+    while has_more and page <= max_pages:
+        json = search_tweets(q, bearer_token, since_id, -1, count, result_type, lang)
+        if json is None:
+            return
+        tweets = json.get("statuses", [])
+
+        if len(tweets) > 0:
+            since_id = max([since_id] + [tweet["id"] for tweet in tweets])
+            page = page + 1
+        yield tweets
+
+        has_more = len(tweets) == count
+        print("more", has_more, "page", page, "since_id", since_id, "tweets", len(tweets))
+
+
+def write_tweets(tx, tweets):
+    plan = plan_tweets(tweets)
+    totals = Counter()
+    for key, query in tweet_plan_queries:
+        if len(plan[key]) > 0:
+            totals.update(vars(tx.run(query, {"rows": plan[key]}).consume().counters))
+    update_tweet_rollups(tx, [t["id"] for t in plan["tweets"]], sorted({r["target"] for r in plan["retweeted"]}))
+    return dict(totals)
+
+
+# Unshortening, canonicalizing and hydrating links now happen in one pass over pending links in lib.links;
+# these entry points are kept for the existing handlers.
+def unshorten_links(neo4j_url, neo4j_user, neo4j_pass, limit=1000):
+    from lib.links import process_links
+    process_links(neo4j_url, neo4j_user, neo4j_pass, limit=limit)
+
+
+def hydrate_links(neo4j_url, neo4j_user, neo4j_pass, limit=1000):
+    from lib.links import process_links
+    process_links(neo4j_url, neo4j_user, neo4j_pass, limit=limit)
+
+
+def clean_links(neo4j_url, neo4j_user, neo4j_pass, limit=1000):
+    from lib.links import process_links
+    process_links(neo4j_url, neo4j_user, neo4j_pass, limit=limit)
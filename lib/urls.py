@@ -0,0 +1,43 @@
+from urllib.parse import urlsplit, urlunsplit
+
+tracking_params = {"fbclid", "gclid", "dclid", "gclsrc", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid",
+                   "_hsenc", "_hsmi", "mkt_tok", "ref_src", "ref_url", "vero_id", "s_cid", "__s"}
+default_ports = {"http": ":80", "https": ":443"}
+
+
+def tracking(param):
+    name = param.split("=", 1)[0].lower()
+    return name.startswith("utm_") or name in tracking_params
+
+
+def canonical_url(url):
+    if not url:
+        return url
+    try:
+        scheme, netloc, path, query, fragment = urlsplit(url.strip())
+    except ValueError:
+        return url
+    if not netloc:
+        return url
+
+    scheme = scheme.lower()
+    netloc = netloc.lower()
+    port = default_ports.get(scheme)
+    if port is not None and netloc.endswith(port):
+        netloc = netloc[:-len(port)]
+
+    if len(path) > 1 and path.endswith("/"):
+        path = path.rstrip("/") or "/"
+    elif not path:
+        path = "/"
+
+    # Parameters are compared as raw strings so their encoding survives; a stable sort keeps repeated keys in order.
+    if query:
+        params = [param for param in query.split("&") if param and not tracking(param)]
+        params.sort(key=lambda param: param.split("=", 1)[0])
+        query = "&".join(params)
+
+    # Hash-bang fragments are routes on some sites, every other fragment is only a position on the page.
+    if not fragment.startswith("!"):
+        fragment = ""
+    return urlunsplit((scheme, netloc, path, query, fragment))